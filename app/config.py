@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 import tempfile
@@ -29,16 +30,117 @@ def load_dynamic_config():
     else:
         log.info(f"Using RVC model directory: {rvc_model_dir}")
 
+    # Load HuBERT at startup instead of on the first request
+    preload_hubert = os.environ.get("RVC_PRELOAD_HUBERT", "1") != "0"
+
+    # Loaded RVC voices kept in memory (0 disables a limit)
+    voice_cache_size = int(os.environ.get("RVC_VOICE_CACHE_SIZE", "8"))
+    voice_cache_mb = int(os.environ.get("RVC_VOICE_CACHE_MB", "0"))
+    # Comma separated speaker names which are never evicted
+    pinned_speakers = [
+        s.strip()
+        for s in os.environ.get("RVC_PINNED_SPEAKERS", "").split(",")
+        if s.strip()
+    ]
+
+    # Cross-request batching of synthesizer segments (1 disables batching)
+    batch_size = int(os.environ.get("RVC_BATCH_SIZE", "1"))
+    batch_wait_ms = float(os.environ.get("RVC_BATCH_WAIT_MS", "10"))
+    # Cross-request batching of HuBERT feature extraction (1 disables batching)
+    hubert_batch_size = int(os.environ.get("RVC_HUBERT_BATCH_SIZE", "1"))
+
+    # Processes for chunked harvest/pm F0 extraction on long inputs (0 disables)
+    f0_workers = int(os.environ.get("RVC_F0_WORKERS", "0"))
+    # Segments whose HuBERT features are extracted ahead of the synthesizer on
+    # a worker thread (0 converts segments strictly in sequence)
+    pipeline_depth = int(os.environ.get("RVC_PIPELINE_DEPTH", "0"))
+    # Blend retrieved index features with torch on the model's device
+    index_on_device = os.environ.get("RVC_INDEX_ON_DEVICE", "0") != "0"
+    # Default FAISS retrieval settings, overridden per speaker by a
+    # retrieval.json next to the model (0 keeps the index's own nprobe/efSearch
+    # and faiss' thread count)
+    index_k = int(os.environ.get("RVC_INDEX_K", "8"))
+    index_nprobe = int(os.environ.get("RVC_INDEX_NPROBE", "0"))
+    index_ef_search = int(os.environ.get("RVC_INDEX_EF_SEARCH", "0"))
+    faiss_threads = int(os.environ.get("RVC_FAISS_THREADS", "0"))
+
+    # Synthesizer runtime: eager, torchscript or onnx (see app/rvc/export.py),
+    # overridden per speaker with e.g. RVC_SPEAKER_BACKENDS="speaker2=onnx"
+    backend = os.environ.get("RVC_BACKEND", "eager")
+    speaker_backends = {
+        name.strip(): backend.strip()
+        for name, backend in (
+            s.split("=", 1)
+            for s in os.environ.get("RVC_SPEAKER_BACKENDS", "").split(",")
+            if "=" in s
+        )
+    }
+
+    # Dynamic int8 + bf16 autocast CPU inference (see app/rvc/quantize.py), for
+    # every speaker or only those listed in RVC_QUANTIZED_SPEAKERS
+    quantize = os.environ.get("RVC_QUANTIZE", "0") != "0"
+    quantized_speakers = [
+        s.strip()
+        for s in os.environ.get("RVC_QUANTIZED_SPEAKERS", "").split(",")
+        if s.strip()
+    ]
+
     # Output folder: system temp (unused by you now, but kept for compatibility)
     output_dir = tempfile.gettempdir()
     log.info(f"TTS output directory: {output_dir}")
 
+    # Cache of TTS waveforms before RVC: RAM tier size (0 disables), and an
+    # optional directory keeping them on disk as int16 or float16
+    tts_cache_mb = int(os.environ.get("TTS_CACHE_MB", "0"))
+    tts_cache_dir = os.environ.get("TTS_CACHE_DIR") or None
+    tts_cache_disk_mb = int(os.environ.get("TTS_CACHE_DISK_MB", "0"))
+    tts_cache_dtype = os.environ.get("TTS_CACHE_DTYPE", "int16")
+    # Sentence mode: /generate converts each sentence on its own and caches the
+    # clips per speaker (0 MiB and no directory disables it), then joins them
+    # with short crossfades
+    sentence_cache_mb = int(os.environ.get("SENTENCE_CACHE_MB", "0"))
+    sentence_cache_dir = os.environ.get("SENTENCE_CACHE_DIR") or None
+    sentence_cache_disk_mb = int(os.environ.get("SENTENCE_CACHE_DISK_MB", "0"))
+    sentence_crossfade_ms = float(os.environ.get("SENTENCE_CROSSFADE_MS", "20"))
+    # Converted WAVs of whole /generate requests, served with an ETag (no
+    # directory disables it, 0 MiB leaves the directory uncapped)
+    result_cache_dir = os.environ.get("RESULT_CACHE_DIR") or None
+    result_cache_mb = int(os.environ.get("RESULT_CACHE_MB", "1024"))
+
     return {
         "rvc": {
             "model_dir": rvc_model_dir,
+            "preload_hubert": preload_hubert,
+            "voice_cache_size": voice_cache_size,
+            "voice_cache_mb": voice_cache_mb,
+            "pinned_speakers": pinned_speakers,
+            "batch_size": batch_size,
+            "batch_wait_ms": batch_wait_ms,
+            "hubert_batch_size": hubert_batch_size,
+            "f0_workers": f0_workers,
+            "pipeline_depth": pipeline_depth,
+            "index_on_device": index_on_device,
+            "index_k": index_k,
+            "index_nprobe": index_nprobe,
+            "index_ef_search": index_ef_search,
+            "faiss_threads": faiss_threads,
+            "backend": backend,
+            "speaker_backends": speaker_backends,
+            "quantize": quantize,
+            "quantized_speakers": quantized_speakers,
         },
         "tts": {
-            "output_dir": output_dir
+            "output_dir": output_dir,
+            "cache_mb": tts_cache_mb,
+            "cache_dir": tts_cache_dir,
+            "cache_disk_mb": tts_cache_disk_mb,
+            "cache_dtype": tts_cache_dtype,
+            "sentence_cache_mb": sentence_cache_mb,
+            "sentence_cache_dir": sentence_cache_dir,
+            "sentence_cache_disk_mb": sentence_cache_disk_mb,
+            "sentence_crossfade_ms": sentence_crossfade_ms,
+            "result_cache_dir": result_cache_dir,
+            "result_cache_mb": result_cache_mb,
         }
     }
 
@@ -104,10 +206,19 @@ def load_speakers(config):
             # Default Bark voice mapping
             bark_voice = "v2/en_speaker_6"
 
+            # Optional retrieval settings: {"k": 8, "nprobe": 4, "ef_search": 64}
+            retrieval = {}
+            retrieval_file = os.path.join(model_dir, "retrieval.json")
+            if os.path.isfile(retrieval_file):
+                with open(retrieval_file) as f:
+                    retrieval = json.load(f)
+                log.info(f"RVC model '{speaker_name}' retrieval settings: {retrieval}")
+
             rvc_speakers[speaker_name] = {
                 "id": rel_path,
                 "bark_voice": bark_voice,
                 "index": index_rel,
+                "retrieval": retrieval,
             }
 
         if not rvc_speakers:
@@ -0,0 +1,120 @@
+"""
+Size-capped on-disk blob store shared by the worker processes.
+
+Blobs are files named by their key under `root`, written atomically so readers
+never see a partial file. Reading a blob refreshes its mtime, and once the
+store grows past `max_bytes` the least recently used files are removed down to
+`LOW_WATER` of the cap, so a full store is not rescanned on every write.
+"""
+
+import os
+import threading
+
+from structlog import get_logger
+
+log = get_logger(__name__)
+
+LOW_WATER = 0.9  # fraction of `max_bytes` left after pruning
+
+
+class DiskStore(object):
+    def __init__(self, root, max_bytes=0, suffix=""):
+        self.root = root
+        self.max_bytes = max_bytes  # 0 disables the cap
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+        self._bytes = sum(size for _, _, size in self._files())
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key + self.suffix)
+
+    def _files(self):
+        """(mtime, path, size) of every blob, other workers' included"""
+        files = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(self.suffix) or name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:  # removed by another worker
+                    continue
+                files.append((st.st_mtime, path, st.st_size))
+        return files
+
+    def get(self, key):
+        """The blob stored under `key` as bytes, or None"""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            f = open(tmp, "wb")
+        except FileNotFoundError:  # empty shard removed by a concurrent prune
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = open(tmp, "wb")
+        with f:
+            f.write(data)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp, path)
+        with self._lock:
+            self._bytes += len(data) - replaced
+            over = self.max_bytes and self._bytes > self.max_bytes
+        if over:
+            self.prune()
+
+    def prune(self):
+        """Remove the least recently used blobs until under `LOW_WATER`"""
+        with self._lock:
+            files = sorted(self._files())
+            total = sum(size for _, _, size in files)
+            target = self.max_bytes * LOW_WATER
+            shards = set()
+            for _, path, size in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                shards.add(os.path.dirname(path))
+                total -= size
+                self.evictions += 1
+            self._bytes = total
+        for shard in shards:
+            try:
+                os.rmdir(shard)  # only succeeds once the shard is empty
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "root": self.root,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -4,7 +4,10 @@ import time
 import uvicorn
 import structlog
 import logging
-from .routers import full, list_speakers
+from fastapi.concurrency import run_in_threadpool
+from .config import config
+from .routers import full, list_speakers, stats, ws
+from .rvc.registry import registry
 import nltk
 nltk.download('punkt')
 
@@ -76,8 +79,18 @@ async def log_requests(request: Request, call_next):
     
     return response
 
+@app.on_event("startup")
+async def preload_models():
+    # Keep HuBERT off the request path
+    if config["rvc"]["model_dir"] and config["rvc"]["preload_hubert"]:
+        await run_in_threadpool(registry.hubert)
+    for sid in sorted(registry.voices.pinned):
+        await run_in_threadpool(registry.voice, sid)
+
 app.include_router(full.router)
 app.include_router(list_speakers.router)
+app.include_router(stats.router)
+app.include_router(ws.router)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
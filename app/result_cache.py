@@ -0,0 +1,72 @@
+"""
+Converted audio of whole `/generate` requests, served again for repeats.
+
+The key hashes the request (speaker, normalized text, emotion, speed), the
+settings that change the output (TTS model, synthesizer backend, quantization,
+retrieval, f0 workers, sentence crossfade), a fingerprint of the speaker's
+model folder, so replacing or converting a model, index or export invalidates
+its entries, and `VERSION`. The key doubles as the response's ETag. The WAV
+bytes live in a size-capped `DiskStore`.
+"""
+
+import hashlib
+import json
+import os
+
+from .disk_store import DiskStore
+
+# Bump when the conversion pipeline changes its output, to drop every entry
+VERSION = 1
+
+
+def folder_fingerprint(path):
+    """(name, size, mtime) of every file in `path`, in name order"""
+    entries = []
+    for entry in os.scandir(path):
+        if entry.is_file():
+            st = entry.stat()
+            entries.append((entry.name, st.st_size, st.st_mtime_ns))
+    return sorted(entries)
+
+
+def etag_matches(if_none_match, etag):
+    """RFC 9110 weak comparison of an If-None-Match header against `etag`"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return etag in [t[2:] if t.startswith("W/") else t for t in tags]
+
+
+class ResultCache(object):
+    def __init__(self, directory=None, max_bytes=0):
+        self.store = DiskStore(directory, max_bytes, ".wav") if directory else None
+
+    def configure(self, directory=None, max_bytes=0):
+        self.__init__(directory, max_bytes)
+
+    @property
+    def enabled(self):
+        return self.store is not None
+
+    @staticmethod
+    def key(*parts):
+        script = json.dumps([VERSION, *parts])
+        return hashlib.sha256(script.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def etag(key):
+        return f'"{key}"'
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def put(self, key, data):
+        self.store.put(key, data)
+
+    def stats(self):
+        return self.store.stats() if self.store is not None else None
+
+
+result_cache = ResultCache()
@@ -1,9 +1,11 @@
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse, FileResponse
-from .tts import server
+from fastapi import APIRouter, Header, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from .tts import result_key, server, stream_server, get_rvc_speaker_id
+from ..result_cache import etag_matches, result_cache
+from ..rvc.registry import registry
 from pydantic import BaseModel
 from typing import Optional
-import io
 
 router = APIRouter(
     prefix="/generate",
@@ -18,8 +20,24 @@ class Generation(BaseModel):
     speed: Optional[float] = 1.0
 
 @router.post("/")
-async def generate(gen: Generation):
-    from fastapi.concurrency import run_in_threadpool
+async def generate(gen: Generation, if_none_match: Optional[str] = Header(None)):
+    """Generate the WAV, served from `result_cache` for repeated requests
+
+    With the cache enabled the response carries an ETag, and a request whose
+    If-None-Match matches it gets a 304 without any work.
+    """
+    headers = {}
+    if result_cache.enabled:
+        key = await run_in_threadpool(
+            result_key, gen.input_text, gen.speaker_name, gen.emotion, gen.speed
+        )
+        headers["ETag"] = result_cache.etag(key)
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        cached = await run_in_threadpool(result_cache.get, key)
+        if cached is not None:
+            return Response(cached, media_type="audio/wav", headers=headers)
+
     rvc_speaker_id, audio_data = await run_in_threadpool(
         server,
         text=gen.input_text,
@@ -27,9 +45,44 @@ async def generate(gen: Generation):
         emotion=gen.emotion,
         speed=gen.speed 
     )
-    if isinstance(audio_data, io.BytesIO):
-        audio_data.seek(0)
-        return StreamingResponse(audio_data, media_type="audio/wav")
+    if result_cache.enabled:
+        await run_in_threadpool(result_cache.put, key, audio_data.getvalue())
+    audio_data.seek(0)
+    return StreamingResponse(audio_data, media_type="audio/wav", headers=headers)
+
 
-    # TTS-only returns a filepath
-    return FileResponse(audio_data, media_type="audio/wav")
+@router.post("/stream")
+async def generate_stream(gen: Generation, format: str = "wav"):
+    """Stream the audio sentence by sentence
+
+    `format=wav` (default) sends a WAV header with unbounded length fields then
+    16-bit mono PCM, `format=pcm` sends the raw little-endian PCM only, with
+    the sample rate in an X-Sample-Rate header. (audio/L16 would mean
+    big-endian samples.)
+    """
+    if format not in ("wav", "pcm"):
+        raise HTTPException(status_code=400, detail=f"Unsupported format \"{format}\"")
+
+    # Validate the speaker and load its model before the response starts
+    voice = await run_in_threadpool(registry.voice, get_rvc_speaker_id(gen.speaker_name))
+    headers = {}
+    if format == "wav":
+        media_type = "audio/wav"
+    else:
+        media_type = "application/octet-stream"
+        headers = {
+            "X-Sample-Rate": str(voice.tgt_sr),
+            "X-Sample-Format": "s16le",
+            "X-Channels": "1",
+        }
+    return StreamingResponse(
+        stream_server(
+            text=gen.input_text,
+            speaker_name=gen.speaker_name,
+            emotion=gen.emotion,
+            speed=gen.speed,
+            format=format,
+        ),
+        media_type=media_type,
+        headers=headers,
+    )
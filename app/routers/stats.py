@@ -0,0 +1,24 @@
+from fastapi import APIRouter
+from ..rvc.index import index_cache
+from ..rvc.registry import registry
+from ..rvc.vc_infer_pipeline import harvest_f0_cache
+from ..result_cache import result_cache
+from ..tts_cache import sentence_cache, tts_cache
+
+router = APIRouter(
+    prefix="/stats",
+    tags=["stats"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("/")
+async def get_stats():
+    """Load times and memory footprint of the resident models"""
+    return {
+        **registry.stats(),
+        "indexes": index_cache.stats(),
+        "harvest_f0": harvest_f0_cache.stats(),
+        "tts": tts_cache.stats(),
+        "sentences": sentence_cache.stats(),
+        "results": result_cache.stats(),
+    }
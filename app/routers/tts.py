@@ -1,24 +1,24 @@
 from TTS.api import TTS
-import huggingface_hub, numpy as np, os, time, io, glob, torch
+import numpy as np, os, time, io, glob, torch
 from nltk.tokenize import sent_tokenize
 from scipy.io.wavfile import write
 from typing import Optional
 from fastapi import HTTPException
 from ..config import config, bark_voices, rvc_speakers
-from ..rvc.misc import (
-    load_hubert,
-    get_vc,
-    vc_single
-)
+from ..rvc.audio import join_crossfade, resample, wav_header
+from ..rvc.f0 import f0_engine
+from ..rvc.index import index_cache
+from ..rvc.misc import vc_single, vc_stream
+from ..rvc.registry import registry
+from ..result_cache import folder_fingerprint, result_cache
+from ..tts_cache import normalize_text, sentence_cache, tts_cache
 from structlog import get_logger
 
 BASE_DIR = os.path.abspath(os.getcwd())
 RVC_MODEL_DIR = os.path.join(BASE_DIR, "models")
 OUTPUT_DIR = os.path.join(BASE_DIR, "output")
-TMP_DIR = os.path.join(BASE_DIR, "tmp")
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-os.makedirs(TMP_DIR, exist_ok=True)
 os.makedirs(RVC_MODEL_DIR, exist_ok=True)
 
 
@@ -58,11 +58,71 @@ def detect_tts_device():
         return "cpu"
 
 
+TTS_MODEL = "tts_models/en/ljspeech/vits"
+
 device = detect_tts_device()
-tts = TTS(model_name="tts_models/en/ljspeech/vits", progress_bar=True, gpu=(device=="cuda"))
+tts = TTS(model_name=TTS_MODEL, progress_bar=True, gpu=(device=="cuda"))
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 log.info(f"TTS initialized on device: {device}")
 
+registry.configure_voices(
+    RVC_MODEL_DIR,
+    max_voices=config["rvc"]["voice_cache_size"],
+    max_bytes=config["rvc"]["voice_cache_mb"] * 1024 * 1024,
+    pinned=[
+        rvc_speakers[name]["id"]
+        for name in config["rvc"]["pinned_speakers"]
+        if name in rvc_speakers
+    ],
+    max_batch=config["rvc"]["batch_size"],
+    max_wait_ms=config["rvc"]["batch_wait_ms"],
+    backend=config["rvc"]["backend"],
+    backends={
+        rvc_speakers[name]["id"]: backend
+        for name, backend in config["rvc"]["speaker_backends"].items()
+        if name in rvc_speakers
+    },
+    quantized=[
+        rvc_speakers[name]["id"]
+        for name in (
+            rvc_speakers
+            if config["rvc"]["quantize"]
+            else config["rvc"]["quantized_speakers"]
+        )
+        if name in rvc_speakers
+    ],
+)
+registry.configure_features(
+    max_batch=config["rvc"]["hubert_batch_size"],
+    max_wait_ms=config["rvc"]["batch_wait_ms"],
+)
+f0_engine.configure(workers=config["rvc"]["f0_workers"])
+tts_cache.configure(
+    max_bytes=config["tts"]["cache_mb"] * 1024 * 1024,
+    directory=config["tts"]["cache_dir"],
+    max_disk_bytes=config["tts"]["cache_disk_mb"] * 1024 * 1024,
+    dtype=config["tts"]["cache_dtype"],
+)
+sentence_cache.configure(
+    max_bytes=config["tts"]["sentence_cache_mb"] * 1024 * 1024,
+    directory=config["tts"]["sentence_cache_dir"],
+    max_disk_bytes=config["tts"]["sentence_cache_disk_mb"] * 1024 * 1024,
+)
+result_cache.configure(
+    directory=config["tts"]["result_cache_dir"],
+    max_bytes=config["tts"]["result_cache_mb"] * 1024 * 1024,
+)
+index_cache.configure(
+    on_device=config["rvc"]["index_on_device"],
+    k=config["rvc"]["index_k"],
+    nprobe=config["rvc"]["index_nprobe"],
+    ef_search=config["rvc"]["index_ef_search"],
+    threads=config["rvc"]["faiss_threads"],
+)
+for speaker in rvc_speakers.values():
+    index_cache.configure_index(
+        os.path.join(RVC_MODEL_DIR, speaker["index"]), **speaker["retrieval"]
+    )
 
 def get_output_filename(user_name: Optional[str] = None):
     """
@@ -105,72 +165,197 @@ def get_output_filename(user_name: Optional[str] = None):
     return os.path.join(OUTPUT_DIR, f"output_{next_number}.wav")
 
 
-def server(
+def get_rvc_speaker_id(speaker_name: str):
+    # Is the speaker an RVC model?
+    if speaker_name not in rvc_speakers:
+        raise HTTPException(status_code=400, detail=f"speaker_name \"{speaker_name}\" was not found")
+    return rvc_speakers[speaker_name]["id"]
+
+
+def result_key(
         text: str,
         speaker_name: str,
-        file_name: Optional[str] = None,
         emotion: Optional[str] = None,
-        speed: Optional[float] = 1.0
+        speed: Optional[float] = 1.0,
     ):
-
-
-    # TTS output file path
-    tts_tmp_file = os.path.join(TMP_DIR, "audio_tmp.wav")
-
-    # Is the speaker an RVC model?
-    rvc_speaker_id = None
-    if speaker_name in rvc_speakers:
-        rvc_speaker_id = rvc_speakers[speaker_name]["id"]
-    else:
-        raise HTTPException(status_code=400, detail=f"speaker_name \"{speaker_name}\" was not found")
-
-    # Prepare the text
+    """`result_cache` key of a `server` call, stale once the speaker's files change"""
+    rvc_speaker_id = get_rvc_speaker_id(speaker_name)
+    file_index = os.path.join(RVC_MODEL_DIR, rvc_speakers[speaker_name]["index"])
+    voices = registry.voices
+    return result_cache.key(
+        TTS_MODEL,
+        normalize_text(text),
+        emotion or "",
+        float(speed or 1.0),
+        rvc_speaker_id,
+        voices.backends.get(rvc_speaker_id, voices.backend),
+        rvc_speaker_id in voices.quantized,
+        index_cache.settings(file_index),  # RVC_INDEX_* merged with retrieval.json
+        config["rvc"]["f0_workers"],
+        sentence_cache.enabled,  # sentence mode assembles different audio
+        config["tts"]["sentence_crossfade_ms"],
+        folder_fingerprint(os.path.dirname(os.path.join(RVC_MODEL_DIR, rvc_speaker_id))),
+    )
+
+
+def split_sentences(text: str):
     script = text.replace("\n", " ").strip()
-    sentences = sent_tokenize(script)
-    full_script = " ".join(sentences)
+    return sent_tokenize(script)
+
 
-    # Generate audio using TTS
-    tts.tts_to_file(text=full_script, file_path=tts_tmp_file, emotion=emotion, speed=speed)
+def synthesize(text: str, emotion: Optional[str] = None, speed: Optional[float] = 1.0):
+    """Run Coqui TTS in memory, returning the waveform and its sample rate
 
+    Repeated scripts come from `tts_cache` when it is enabled, the waveform is
+    then read-only.
+    """
+    if tts_cache.enabled:
+        key = tts_cache.key(text, emotion, speed, TTS_MODEL)
+        cached = tts_cache.get(key)
+        if cached is not None:
+            return cached
     t0 = time.time()
+    tts_wav = np.asarray(tts.tts(text=text, emotion=emotion, speed=speed), dtype=np.float32)
     generation_duration_s = time.time() - t0
     log.info(f"took {generation_duration_s:.0f}s to generate audio")
+    if tts_cache.enabled:
+        return tts_cache.put(key, tts_wav, tts.synthesizer.output_sample_rate)
+    return tts_wav, tts.synthesizer.output_sample_rate
+
+
+def convert(speaker_name: str, tts_wav: np.ndarray, tts_sr: int, voice=None):
+    """Convert TTS audio to the RVC speaker's voice, returning (sample rate, int16 audio)"""
+    if voice is None:
+        voice = registry.voice(rvc_speakers[speaker_name]["id"])
+    hubert_model = registry.features(quantized=voice.quantized)
+
+    rvc_index = os.path.join(RVC_MODEL_DIR, rvc_speakers[speaker_name]["index"])
+    wav_opt = vc_single(
+        0, 
+        None,
+        0, 
+        None, 
+        "pm", 
+        rvc_index,
+        '',
+        0.88,
+        3,
+        0,
+        1,
+        0.33,
+        hubert_model=hubert_model,
+        voice=voice,
+        audio=resample(tts_wav, tts_sr, 16000),
+        pipeline_depth=config["rvc"]["pipeline_depth"],
+    )
+
+    if wav_opt is None or wav_opt[1][1] is None:
+        raise HTTPException(500, "RVC conversion failed: wav_opt returned None.")
+    return wav_opt[1]
+
+
+def convert_stream(speaker_name: str, tts_wav: np.ndarray, tts_sr: int, voice=None):
+    """Like `convert`, yielding int16 audio segment by segment for long inputs"""
+    if voice is None:
+        voice = registry.voice(rvc_speakers[speaker_name]["id"])
+    hubert_model = registry.features(quantized=voice.quantized)
+
+    rvc_index = os.path.join(RVC_MODEL_DIR, rvc_speakers[speaker_name]["index"])
+    yield from vc_stream(
+        0,
+        resample(tts_wav, tts_sr, 16000),
+        0,
+        "pm",
+        rvc_index,
+        0.88,
+        3,
+        1,
+        0.33,
+        hubert_model,
+        voice,
+        pipeline_depth=config["rvc"]["pipeline_depth"],
+    )
+
+
+def speak_sentence(
+        sentence: str,
+        speaker_name: str,
+        emotion: Optional[str] = None,
+        speed: Optional[float] = 1.0,
+        voice=None,
+    ):
+    """TTS + RVC for a single sentence, returning little-endian 16-bit PCM bytes"""
+    tts_wav, tts_sr = synthesize(sentence, emotion, speed)
+    _, audio = convert(speaker_name, tts_wav, tts_sr, voice=voice)
+    return audio.astype("<i2").tobytes()
 
-    if rvc_speaker_id and RVC_MODEL_DIR:
-        hubert_model = None
-        hubert_path = huggingface_hub.hf_hub_download(
-            repo_id="lj1995/VoiceConversionWebUI",
-            filename="hubert_base.pt",
-            revision="1c75048c96f23f99da4b12909b532b5983290d7d",
-            local_dir="models/hubert/",
-            local_dir_use_symlinks=True,
-        )
-        hubert_model = load_hubert(hubert_path)
-        
-        get_vc(rvc_speaker_id, RVC_MODEL_DIR, 0.33, 0.5)
-        
-        rvc_index = os.path.join(RVC_MODEL_DIR, rvc_speakers[speaker_name]["index"])
-        wav_opt = vc_single(
-            0, 
-            tts_tmp_file,
-            0, 
-            None, 
-            "pm", 
-            rvc_index,
-            '',
-            0.88,
-            3,
-            0,
-            1,
-            0.33,
-        )
 
-        if wav_opt is None or wav_opt[1] is None:
-            raise HTTPException(500, "RVC conversion failed: wav_opt returned None.")
+def cached_sentence(sentence: str, speaker_name: str, emotion, speed, voice):
+    """(key, int16 clip) of a converted sentence from `sentence_cache`, or (key, None)"""
+    key = result_key(sentence, speaker_name, emotion, speed)
+    cached = sentence_cache.get(key)
+    if cached is None or cached[1] != voice.tgt_sr:
+        return key, None
+    return key, cached[0]
 
 
+def convert_sentences(
+        text: str,
+        speaker_name: str,
+        emotion: Optional[str] = None,
+        speed: Optional[float] = 1.0,
+    ):
+    """TTS + RVC sentence by sentence, reusing clips from `sentence_cache`
+
+    Only the sentences not seen before for this speaker are synthesized and
+    converted. The clips are joined with short crossfades. Returns
+    (sample rate, int16 audio) like `convert`.
+    """
+    voice = registry.voice(get_rvc_speaker_id(speaker_name))
+    clips = []
+    fresh = 0
+    for sentence in split_sentences(text):
+        key, clip = cached_sentence(sentence, speaker_name, emotion, speed, voice)
+        if clip is None:
+            tts_wav, tts_sr = synthesize(sentence, emotion, speed)
+            _, audio = convert(speaker_name, tts_wav, tts_sr, voice=voice)
+            clip, _ = sentence_cache.put(key, audio.astype(np.int16), voice.tgt_sr)
+            fresh += 1
+        clips.append(clip)
+    log.info(f"converted {fresh} of {len(clips)} sentences, the rest were cached")
+    overlap = int(voice.tgt_sr * config["tts"]["sentence_crossfade_ms"] / 1000)
+    return voice.tgt_sr, join_crossfade(clips, overlap)
+
+
+def server(
+        text: str,
+        speaker_name: str,
+        file_name: Optional[str] = None,
+        emotion: Optional[str] = None,
+        speed: Optional[float] = 1.0
+    ):
+
+    rvc_speaker_id = get_rvc_speaker_id(speaker_name)
+
+    if sentence_cache.enabled and RVC_MODEL_DIR:
         wav = io.BytesIO()
-        write(wav, wav_opt[1][0], wav_opt[1][1])
+        write(wav, *convert_sentences(text, speaker_name, emotion, speed))
+        wav.seek(0)
+        save_path = get_output_filename(file_name)
+        with open(save_path, "wb") as audio_file:
+            audio_file.write(wav.getvalue())
+        log.info(f"Saved final audio file: {save_path}")
+        return rvc_speaker_id, wav
+
+    # Prepare the text
+    full_script = " ".join(split_sentences(text))
+
+    # Generate audio using TTS, kept in memory for RVC
+    tts_wav, tts_sr = synthesize(full_script, emotion, speed)
+
+    if rvc_speaker_id and RVC_MODEL_DIR:
+        wav = io.BytesIO()
+        write(wav, *convert(speaker_name, tts_wav, tts_sr))
         wav.seek(0)
         save_path = get_output_filename(file_name)  # re-use the same naming logic
 
@@ -179,4 +364,41 @@ def server(
         log.info(f"Saved final audio file: {save_path}")
         return rvc_speaker_id, wav
     else:
-        return rvc_speaker_id, tts_tmp_file
+        wav = io.BytesIO()
+        write(wav, tts_sr, tts_wav)
+        wav.seek(0)
+        return rvc_speaker_id, wav
+
+
+def stream_server(
+        text: str,
+        speaker_name: str,
+        emotion: Optional[str] = None,
+        speed: Optional[float] = 1.0,
+        format: str = "wav",
+    ):
+    """Yield converted audio sentence by sentence as soon as each is ready
+
+    With `format="wav"` the stream starts with a WAV header whose length
+    fields mark an unbounded stream, followed by 16-bit PCM. `format="pcm"`
+    yields the raw PCM only. In sentence mode, sentences found in
+    `sentence_cache` are sent at once and new ones are added to it.
+    """
+    voice = registry.voice(get_rvc_speaker_id(speaker_name))
+    if format == "wav":
+        yield wav_header(voice.tgt_sr)
+
+    for sentence in split_sentences(text):
+        if sentence_cache.enabled:
+            key, clip = cached_sentence(sentence, speaker_name, emotion, speed, voice)
+            if clip is not None:
+                yield clip.astype("<i2").tobytes()
+                continue
+        tts_wav, tts_sr = synthesize(sentence, emotion, speed)
+        # A long sentence is split into segments, send each as it is ready
+        segments = []
+        for audio in convert_stream(speaker_name, tts_wav, tts_sr, voice=voice):
+            segments.append(audio.astype(np.int16))
+            yield audio.astype("<i2").tobytes()
+        if sentence_cache.enabled and segments:
+            sentence_cache.put(key, np.concatenate(segments), voice.tgt_sr)
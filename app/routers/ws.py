@@ -0,0 +1,110 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from nltk.tokenize import sent_tokenize
+from structlog import get_logger
+from .tts import get_rvc_speaker_id, speak_sentence
+from ..rvc.registry import registry
+
+log = get_logger(__name__)
+
+router = APIRouter(
+    prefix="/ws",
+    tags=["ws"],
+)
+
+def pop_sentences(buffer: str):
+    """Split complete sentences off the front of `buffer`
+
+    The last sentence punkt finds may still be growing, so it stays in the
+    returned remainder until more text (or a flush) arrives.
+    """
+    sentences = sent_tokenize(buffer)
+    if len(sentences) < 2:
+        return [], buffer
+    return sentences[:-1], buffer[buffer.rfind(sentences[-1]):]
+
+@router.websocket("/generate")
+async def generate_ws(websocket: WebSocket):
+    """Incremental TTS over a WebSocket
+
+    The client first sends `{"speaker_name", "emotion", "speed"}`, then any
+    number of `{"type": "text", "text": ...}` fragments. Each complete sentence
+    is converted and sent back as a binary frame of 16-bit mono PCM.
+    `{"type": "flush"}` speaks whatever text is left and is answered with
+    `{"type": "done"}` once its audio has been sent. `{"type": "cancel"}`
+    drops pending text and any audio not yet sent.
+    """
+    await websocket.accept()
+    start = await websocket.receive_json()
+    speaker_name = start.get("speaker_name")
+    try:
+        speaker_id = get_rvc_speaker_id(speaker_name)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "detail": e.detail})
+        await websocket.close()
+        return
+
+    # Keep the speaker's models hot for the duration of the session
+    voice = await run_in_threadpool(registry.voices.hold, speaker_id)
+    await websocket.send_json(
+        {"type": "start", "sample_rate": voice.tgt_sr, "format": "pcm_s16le"}
+    )
+
+    queue = asyncio.Queue()
+    # Bumped on cancel so sentences queued or in flight before it are dropped
+    utterance = [0]
+
+    async def speak():
+        while True:
+            n, sentence = await queue.get()
+            if n != utterance[0]:
+                continue
+            if sentence is None:
+                await websocket.send_json({"type": "done"})
+                continue
+            try:
+                audio = await run_in_threadpool(
+                    speak_sentence,
+                    sentence,
+                    speaker_name,
+                    start.get("emotion"),
+                    start.get("speed", 1.0),
+                    voice=voice,
+                )
+            except Exception as e:
+                log.error(f"Failed to speak sentence: {e}")
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+            if n == utterance[0]:
+                await websocket.send_bytes(audio)
+
+    speaker = asyncio.create_task(speak())
+    buffer = ""
+    try:
+        while True:
+            msg = await websocket.receive_json()
+            kind = msg.get("type", "text")
+            if kind == "text":
+                buffer += msg.get("text", "").replace("\n", " ")
+                sentences, buffer = pop_sentences(buffer)
+                for sentence in sentences:
+                    queue.put_nowait((utterance[0], sentence))
+            elif kind == "flush":
+                for sentence in sent_tokenize(buffer.strip()):
+                    queue.put_nowait((utterance[0], sentence))
+                queue.put_nowait((utterance[0], None))
+                buffer = ""
+            elif kind == "cancel":
+                utterance[0] += 1
+                buffer = ""
+                await websocket.send_json({"type": "cancelled"})
+            else:
+                await websocket.send_json(
+                    {"type": "error", "detail": f"Unknown message type \"{kind}\""}
+                )
+    except WebSocketDisconnect:
+        log.info(f"WebSocket session for {speaker_name} closed")
+    finally:
+        speaker.cancel()
+        registry.voices.release(speaker_id)
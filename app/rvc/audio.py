@@ -0,0 +1,112 @@
+"""
+In-process audio helpers so conversion does not need a temporary file or an
+ffmpeg subprocess on the request path.
+
+Benchmark against ffmpeg with `python -m benchmarks.audio <file.wav>`.
+"""
+
+import struct
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+from scipy import signal
+from scipy.io import wavfile
+
+# Extensions scipy can decode without ffmpeg
+WAV_EXTENSIONS = (".wav", ".wave")
+
+
+@lru_cache(maxsize=None)
+def _polyphase_filter(up, down):
+    # Same low-pass FIR `resample_poly` designs per call, built once per ratio
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0))
+
+
+def resample(audio, orig_sr, target_sr):
+    """Polyphase resample of a mono float signal to `target_sr`
+
+    The filters for the ratios we use (22050->16000 from the LJSpeech VITS
+    model, 16000->32k/40k/48k) are designed once and reused.
+    """
+    audio = np.asarray(audio, dtype=np.float32)
+    if orig_sr == target_sr:
+        return audio
+    g = gcd(int(orig_sr), int(target_sr))
+    up, down = int(target_sr) // g, int(orig_sr) // g
+    return signal.resample_poly(
+        audio, up, down, window=_polyphase_filter(up, down)
+    ).astype(np.float32)
+
+
+def to_float32(data):
+    """Scale PCM samples to [-1, 1] float32 and down-mix to mono"""
+    if data.dtype == np.uint8:
+        data = (data.astype(np.float32) - 128) / 128
+    elif np.issubdtype(data.dtype, np.integer):
+        data = data.astype(np.float32) / -np.iinfo(data.dtype).min
+    else:
+        data = data.astype(np.float32)
+    if data.ndim == 2:
+        data = data.mean(axis=1)
+    return data
+
+
+def decode_wav(file, sr):
+    """Read a WAV file as mono float32 at `sr`, raising ValueError if unsupported"""
+    orig_sr, data = wavfile.read(file)
+    return resample(to_float32(data), orig_sr, sr)
+
+
+def wav_header(sr, channels=1, bits=16, data_size=0xFFFFFFFF):
+    """PCM WAV header; the default sizes mark a stream of unknown length"""
+    riff_size = 0xFFFFFFFF if data_size == 0xFFFFFFFF else 36 + data_size
+    block_align = channels * bits // 8
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        riff_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,  # PCM
+        channels,
+        sr,
+        sr * block_align,
+        block_align,
+        bits,
+        b"data",
+        data_size,
+    )
+
+
+def join_crossfade(clips, overlap):
+    """Concatenate int16 clips, blending `overlap` samples at each junction
+
+    Linear fades over the overlap sum to one, so steady signals pass through
+    unchanged. Junctions next to very short clips are shortened to fit.
+    """
+    clips = [c for c in clips if len(c)]
+    if not clips:
+        return np.zeros(0, dtype=np.int16)
+    # samples shared with the previous / next clip, at most half of either
+    fades = [0] + [
+        min(overlap, len(a) // 2, len(b) // 2) for a, b in zip(clips, clips[1:])
+    ]
+    fades.append(0)
+    starts = [0]
+    for clip, fade in zip(clips, fades[1:-1]):
+        starts.append(starts[-1] + len(clip) - fade)
+    out = np.zeros(starts[-1] + len(clips[-1]), dtype=np.float32)
+    for i, clip in enumerate(clips):
+        x = clip.astype(np.float32)
+        n_in, n_out = fades[i], fades[i + 1]
+        if n_in:
+            x[:n_in] *= (np.arange(n_in) + 0.5) / n_in
+        if n_out:
+            x[len(x) - n_out :] *= 1 - (np.arange(n_out) + 0.5) / n_out
+        out[starts[i] : starts[i] + len(x)] += x
+    return np.clip(np.round(out), -32768, 32767).astype(np.int16)
+
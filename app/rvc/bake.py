@@ -0,0 +1,120 @@
+"""
+Pre-baked inference checkpoints for RVC voices.
+
+A training checkpoint rebuilds the weight-norm reparameterization of every
+conv on each forward pass, carries the posterior encoder (`enc_q`) that
+inference never uses, and recomputes the speaker conditioning `emb_g(sid)` on
+every call, although the server always converts with the same sid (0). `bake`
+removes all three: weight norm is folded into plain weights, `enc_q` is
+dropped, and the projections of `emb_g(sid)` through `dec.cond` and the flows'
+WN `cond_layer` are added to the biases of the layers they feed.
+
+    python -m app.rvc.bake models/speaker2/speaker2.pth [--sid 0]
+
+replaces the checkpoint in place, keeping the original as `<file>.orig`. The
+baked voice only speaks as the folded sid, whatever sid it is called with.
+`load_vc` recognizes baked checkpoints by their "baked" entry, which records
+the folded sid.
+"""
+
+import argparse
+import os
+
+import torch
+
+
+def remove_weight_norm(net_g):
+    net_g.dec.remove_weight_norm()
+    net_g.flow.remove_weight_norm()
+
+
+def wn_layers(net_g):
+    return [net_g.flow.flows[i * 2].enc for i in range(net_g.flow.n_flows)]
+
+
+@torch.no_grad()
+def fold_speaker(net_g, sid=0):
+    """Fold the constant conditioning of speaker `sid` into the biases"""
+    g = net_g.emb_g(torch.LongTensor([sid])).unsqueeze(-1)  # [1, gin, 1]
+    net_g.dec.conv_pre.bias += net_g.dec.cond(g)[0, :, 0]
+    for wn in wn_layers(net_g):
+        g_all = wn.cond_layer(g)[0, :, 0]
+        for i, in_layer in enumerate(wn.in_layers):
+            offset = i * 2 * wn.hidden_channels
+            in_layer.bias += g_all[offset : offset + 2 * wn.hidden_channels]
+    strip_speaker(net_g)
+
+
+def strip_speaker(net_g):
+    """Drop the speaker conditioning layers, `infer` then passes g=None"""
+    net_g.emb_g = None
+    del net_g.dec.cond
+    for wn in wn_layers(net_g):
+        del wn.cond_layer
+        wn.gin_channels = 0
+
+
+def prepare(net_g, baked):
+    """Give a freshly built `net_g` the layout of a checkpoint baked as `baked`"""
+    remove_weight_norm(net_g)
+    if baked["folded"]:
+        strip_speaker(net_g)
+
+
+def bake(cpt, net_g, sid=0):
+    """Baked checkpoint dict for `net_g`, loaded from the training `cpt`
+
+    Speaker `sid` is folded in, `sid=None` keeps the speaker embedding.
+    """
+    remove_weight_norm(net_g)
+    folded = sid is not None
+    if folded:
+        if not 0 <= sid < net_g.emb_g.num_embeddings:
+            raise ValueError(
+                f"sid {sid} out of range, the model has "
+                f"{net_g.emb_g.num_embeddings} speakers"
+            )
+        fold_speaker(net_g, sid)
+    dtype = next(iter(cpt["weight"].values())).dtype
+    weight = {k: v.to(dtype) for k, v in net_g.state_dict().items()}
+    baked = {k: v for k, v in cpt.items() if k != "weight"}
+    baked["weight"] = weight
+    baked["baked"] = {"folded": folded, "sid": sid}
+    return baked
+
+
+def bake_file(path, output=None, sid=0):
+    from app.rvc.misc import build_net_g
+
+    cpt = torch.load(path, map_location="cpu")
+    if "baked" in cpt:
+        print(f"{path} is already baked")
+        return path
+    cpt["config"][-3] = cpt["weight"]["emb_g.weight"].shape[0]  # n_spk, as load_vc
+    net_g = build_net_g(cpt, is_half=False)
+    del net_g.enc_q
+    net_g.load_state_dict(cpt["weight"], strict=False)
+    baked = bake(cpt, net_g.float().eval(), sid)
+    if output is None:
+        output = path
+        os.replace(path, path + ".orig")
+    torch.save(baked, output)
+    print(
+        f"Wrote {output} ({os.path.getsize(output) / 2**20:.1f} MiB, "
+        f"speaker folded: {baked['baked']['sid']})"
+    )
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("checkpoint")
+    parser.add_argument("--output")
+    parser.add_argument(
+        "--sid", type=int, default=0, help="speaker to fold in (server() uses 0)"
+    )
+    parser.add_argument(
+        "--keep-speakers", action="store_true", help="do not fold a speaker in"
+    )
+    args = parser.parse_args()
+    bake_file(args.checkpoint, args.output, None if args.keep_speakers else args.sid)
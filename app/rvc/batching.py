@@ -0,0 +1,174 @@
+"""
+Cross-request dynamic batching for the RVC models.
+
+Work from concurrent requests is collected for up to `max_wait_ms`, padded to
+a common length and run as one forward pass:
+
+- `InferBatcher` batches synthesizer segments for one voice. `phone_lengths`
+  carries each segment's true length so the text encoder's `x_mask` hides the
+  padding, and each output is cut back to its own length.
+- `FeatureBatcher` batches HuBERT feature extraction, which is speaker
+  independent, across every request. The convolutional front-end (which
+  normalises over time) runs per segment, the transformer runs batched with a
+  real padding mask.
+"""
+
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+
+
+class _Item(object):
+    def __init__(self, key, **kwargs):
+        self.key = key
+        self.__dict__.update(kwargs)
+        self.future = Future()
+
+
+class _Batcher(object):
+    def __init__(self, max_batch=4, max_wait_ms=10, idle_s=30):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.idle_s = idle_s
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self.batch_sizes = Counter()
+
+    def _submit(self, item):
+        with self._cond:
+            self._pending.append(item)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._cond.notify_all()
+        return item.future.result()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait(self.idle_s)
+                    if not self._pending:
+                        # Let the thread (and its hold on the model) go when idle
+                        self._worker = None
+                        return
+                deadline = time.time() + self.max_wait
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # Only items sharing the first item's key can run together
+                key = self._pending[0].key
+                batch = [i for i in self._pending if i.key == key][: self.max_batch]
+                for item in batch:
+                    self._pending.remove(item)
+                self.batch_sizes[len(batch)] += 1
+            try:
+                self._process(batch)
+            except Exception as e:
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+
+    def _process(self, batch):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._cond:
+            batch_sizes = dict(self.batch_sizes)
+        batches = sum(batch_sizes.values())
+        items = sum(size * count for size, count in batch_sizes.items())
+        return {
+            "batches": batches,
+            "mean_batch_size": items / batches if batches else None,
+            "batch_sizes": batch_sizes,
+        }
+
+
+class InferBatcher(_Batcher):
+    """Stands in for `net_g` wherever only `net_g.infer` is called"""
+
+    def __init__(self, net_g, max_batch=4, max_wait_ms=10, idle_s=30):
+        super().__init__(max_batch, max_wait_ms, idle_s)
+        self.net_g = net_g
+
+    def infer(self, phone, phone_lengths, *args):
+        # (pitch, nsff0, sid) for the f0 models, (sid,) for the nono ones
+        pitch, nsff0, sid = args if len(args) == 3 else (None, None, args[0])
+        item = _Item(
+            None,
+            phone=phone,
+            phone_lengths=phone_lengths,
+            pitch=pitch,
+            nsff0=nsff0,
+            sid=sid,
+        )
+        return (self._submit(item),)
+
+    def _process(self, batch):
+        t = max(item.phone.shape[1] for item in batch)
+        phone = torch.cat(
+            [F.pad(i.phone, (0, 0, 0, t - i.phone.shape[1])) for i in batch]
+        )
+        phone_lengths = torch.cat([i.phone_lengths for i in batch])
+        sid = torch.cat([i.sid for i in batch])
+        with torch.no_grad():
+            if batch[0].pitch is not None:
+                pitch = torch.cat(
+                    [F.pad(i.pitch, (0, t - i.pitch.shape[1])) for i in batch]
+                )
+                nsff0 = torch.cat(
+                    [F.pad(i.nsff0, (0, t - i.nsff0.shape[1])) for i in batch]
+                )
+                o = self.net_g.infer(phone, phone_lengths, pitch, nsff0, sid)[0]
+            else:
+                o = self.net_g.infer(phone, phone_lengths, sid)[0]
+        upp = o.shape[2] // t
+        for n, item in enumerate(batch):
+            item.future.set_result(o[n : n + 1, :, : item.phone.shape[1] * upp])
+
+
+class FeatureBatcher(_Batcher):
+    """Batched `extract_features` for a fairseq HuBERT model"""
+
+    def __init__(self, model, max_batch=4, max_wait_ms=10, idle_s=30):
+        super().__init__(max_batch, max_wait_ms, idle_s)
+        self.model = model
+
+    def extract(self, source, version):
+        """Features for one 16 kHz segment `[1, samples]`, as `[1, frames, dim]`
+
+        Layer 9 projected through `final_proj` for v1 models, layer 12 for v2,
+        matching `VC.vc`.
+        """
+        return self._submit(_Item(version, source=source))
+
+    def _process(self, batch):
+        model = self.model
+        version = batch[0].key
+        with torch.no_grad():
+            # [1, C, frames] per segment
+            features = [model.forward_features(i.source) for i in batch]
+            lengths = [f.shape[2] for f in features]
+            t = max(lengths)
+            x = torch.cat([F.pad(f, (0, t - f.shape[2])) for f in features])
+            padding_mask = (
+                torch.arange(t, device=x.device)[None, :]
+                >= torch.tensor(lengths, device=x.device)[:, None]
+            )
+            x = model.layer_norm(x.transpose(1, 2))
+            if model.post_extract_proj is not None:
+                x = model.post_extract_proj(x)
+            x, _ = model.encoder(
+                x, padding_mask=padding_mask, layer=(9 if version == "v1" else 12) - 1
+            )
+            if version == "v1":
+                x = model.final_proj(x)
+        for n, item in enumerate(batch):
+            item.future.set_result(x[n : n + 1, : lengths[n]])
@@ -0,0 +1,238 @@
+"""
+TorchScript and ONNX exports of the RVC synthesizer for CPU serving.
+
+Eager `net_g.infer` dispatches hundreds of small conv/activation ops through
+Python for every segment. `export` traces `infer` once, on CPU in float32,
+with the batch and time axes left dynamic, and saves it next to the voice:
+
+    python -m app.rvc.export models/speaker2/speaker2.pth [torchscript|onnx]
+    python -m app.rvc.export check models/speaker2/speaker2.pth
+    python -m app.rvc.export bench models/speaker2/speaker2.pth
+
+`check` compares each backend against eager with the noise sources zeroed (the
+backends draw their own noise otherwise), `bench` times each backend per
+segment length. Exports of baked checkpoints (see `app.rvc.bake`) are faster
+still. Serving a voice through an export is selected with
+`app.rvc.misc.use_backend`. ONNX needs `onnxruntime` installed.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+
+import torch
+
+BACKENDS = ("eager", "torchscript", "onnx")
+SUFFIXES = {"torchscript": ".ts", "onnx": ".onnx"}
+
+
+def export_path(weight_path, backend):
+    return os.path.splitext(weight_path)[0] + SUFFIXES[backend]
+
+
+class _Infer(torch.nn.Module):
+    """`net_g.infer` returning only the audio, as a traceable forward"""
+
+    def __init__(self, net_g):
+        super().__init__()
+        self.net_g = net_g
+
+    def forward(self, *args):
+        return self.net_g.infer(*args)[0]
+
+
+def input_names(if_f0):
+    if if_f0 == 1:
+        return ["phone", "phone_lengths", "pitch", "pitchf", "sid"]
+    return ["phone", "phone_lengths", "sid"]
+
+
+def example_inputs(net_g, if_f0, frames=200, batch=1, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    channels = net_g.enc_p.emb_phone.in_features  # 256 for v1, 768 for v2
+    phone = torch.randn(batch, frames, channels, generator=g)
+    phone_lengths = torch.full((batch,), frames, dtype=torch.long)
+    sid = torch.zeros(batch, dtype=torch.long)
+    if if_f0 != 1:
+        return phone, phone_lengths, sid
+    pitch = torch.randint(1, 255, (batch, frames), generator=g)
+    pitchf = torch.rand(batch, frames, generator=g) * 300 + 80
+    return phone, phone_lengths, pitch, pitchf, sid
+
+
+def export_torchscript(net_g, if_f0, path):
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        traced = torch.jit.trace(
+            _Infer(net_g), example_inputs(net_g, if_f0), check_trace=False
+        )
+    traced.save(path)
+    return path
+
+
+def export_onnx(net_g, if_f0, path):
+    names = input_names(if_f0)
+    dynamic_axes = {name: {0: "batch"} for name in names}
+    for name in ("phone", "pitch", "pitchf"):
+        if name in dynamic_axes:
+            dynamic_axes[name][1] = "frames"
+    dynamic_axes["audio"] = {0: "batch", 2: "samples"}
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        torch.onnx.export(
+            _Infer(net_g),
+            example_inputs(net_g, if_f0),
+            path,
+            input_names=names,
+            output_names=["audio"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+    return path
+
+
+EXPORTERS = {"torchscript": export_torchscript, "onnx": export_onnx}
+
+
+class TorchScriptSynth(object):
+    """Stands in for `net_g` wherever only `net_g.infer` is called"""
+
+    def __init__(self, path):
+        self.module = torch.jit.load(path, map_location="cpu").eval()
+
+    def infer(self, *args):
+        args = [a.float() if a.is_floating_point() else a for a in args]
+        with torch.no_grad():
+            return (self.module(*[a.cpu() for a in args]),)
+
+    def parameters(self):
+        return self.module.parameters()
+
+    def buffers(self):
+        return self.module.buffers()
+
+    def state_dict(self, **kwargs):
+        return self.module.state_dict(**kwargs)
+
+
+class OnnxSynth(object):
+    """`net_g.infer` through an ONNX Runtime CPU session"""
+
+    def __init__(self, path):
+        import onnxruntime
+
+        self.nbytes = os.path.getsize(path)
+        self.session = onnxruntime.InferenceSession(
+            path, providers=["CPUExecutionProvider"]
+        )
+        # Inputs the graph does not use (sid once folded) are pruned on export
+        self.inputs = {i.name for i in self.session.get_inputs()}
+
+    def infer(self, *args):
+        names = input_names(1 if len(args) == 5 else 0)
+        feed = {
+            name: arg.detach().cpu().float().numpy()
+            if arg.is_floating_point()
+            else arg.detach().cpu().numpy()
+            for name, arg in zip(names, args)
+            if name in self.inputs
+        }
+        return (torch.from_numpy(self.session.run(None, feed)[0]),)
+
+
+RUNTIMES = {"torchscript": TorchScriptSynth, "onnx": OnnxSynth}
+
+
+def load_backend(backend, weight_path):
+    """`net_g` replacement serving `weight_path` through `backend`'s export"""
+    path = export_path(weight_path, backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"{path} not found, run: python -m app.rvc.export {weight_path} {backend}"
+        )
+    if os.path.getmtime(path) < os.path.getmtime(weight_path):
+        raise RuntimeError(f"{path} is older than {weight_path}, export it again")
+    return RUNTIMES[backend](path)
+
+
+def load_eager(weight_path):
+    from app.rvc.misc import load_vc
+
+    voice = load_vc(os.path.basename(weight_path), os.path.dirname(weight_path))
+    return voice.net_g.float().cpu(), voice.if_f0
+
+
+def export(weight_path, backends=("torchscript", "onnx")):
+    net_g, if_f0 = load_eager(weight_path)
+    for backend in backends:
+        path = EXPORTERS[backend](net_g, if_f0, export_path(weight_path, backend))
+        print(f"Wrote {path} ({os.path.getsize(path) / 2**20:.1f} MiB)")
+
+
+@contextmanager
+def no_noise():
+    """Zero the noise `infer` draws, so backends can be compared exactly"""
+    randn_like = torch.randn_like
+    torch.randn_like = lambda x, **kwargs: torch.zeros_like(x)
+    try:
+        yield
+    finally:
+        torch.randn_like = randn_like
+
+
+def check(weight_path, frames=(50, 200, 777), tmp_dir=None):
+    """Print each backend's max |diff| against eager, see tests/test_export.py"""
+    net_g, if_f0 = load_eager(weight_path)
+    name = os.path.splitext(os.path.basename(weight_path))[0]
+    with no_noise(), tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        synths = {
+            backend: RUNTIMES[backend](
+                EXPORTERS[backend](
+                    net_g,
+                    if_f0,
+                    os.path.join(tmp, f"{name}.check{SUFFIXES[backend]}"),
+                )
+            )
+            for backend in EXPORTERS
+        }
+        for n in frames:
+            args = example_inputs(net_g, if_f0, n, seed=n)
+            with torch.no_grad():
+                ref = net_g.infer(*args)[0]
+            for backend, synth in synths.items():
+                out = synth.infer(*args)[0]
+                diff = (out - ref).abs().max().item()
+                print(f"{backend:12s} {n:4d} frames: max |diff| {diff:.2e}")
+
+
+def bench(weight_path, frames=(100, 500, 2000), repeat=3):
+    net_g, if_f0 = load_eager(weight_path)
+    synths = {"eager": net_g}
+    for backend in RUNTIMES:
+        try:
+            synths[backend] = load_backend(backend, weight_path)
+        except (FileNotFoundError, RuntimeError, ImportError) as e:
+            print(f"skipping {backend}: {e}")
+    for n in frames:
+        args = example_inputs(net_g, if_f0, n)
+        for backend, synth in synths.items():
+            with torch.no_grad():
+                synth.infer(*args)  # warm up
+                t0 = time.time()
+                for _ in range(repeat):
+                    synth.infer(*args)
+            ms = (time.time() - t0) / repeat * 1000
+            print(f"{backend:12s} {n:5d} frames: {ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == "check":
+        check(sys.argv[2])
+    elif sys.argv[1] == "bench":
+        bench(sys.argv[2])
+    else:
+        export(sys.argv[1], sys.argv[2:] or ("torchscript", "onnx"))
@@ -0,0 +1,193 @@
+"""
+Parallel, chunked F0 extraction for long inputs.
+
+`pyworld.harvest` and parselmouth's `to_pitch_ac` run on a single core over
+the whole utterance. `F0Engine` splits the 16 kHz audio into windows aligned to
+the 160-sample hop, with `overlap_s` of extra context on each side, extracts F0
+for each window on a process pool and crossfades the curves across the
+overlaps. Harvest only looks a few pitch periods around each frame, so the
+stitched curve matches a single pass to float precision. Praat's voicing
+decisions depend on the whole signal (global peak, path finder), so chunked pm
+agrees within a few cents with occasional voicing flips.
+
+Compare against the single pass with `python -m app.rvc.f0 <file.wav>`.
+"""
+
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import parselmouth
+import pyworld
+
+SR = 16000
+HOP = 160  # samples per F0 frame (10 ms)
+
+
+def harvest(audio, fs=SR, f0max=1100, f0min=50, frame_period=10):
+    audio = np.ascontiguousarray(audio, dtype=np.double)
+    f0, t = pyworld.harvest(
+        audio,
+        fs=fs,
+        f0_ceil=f0max,
+        f0_floor=f0min,
+        frame_period=frame_period,
+    )
+    return pyworld.stonemask(audio, f0, t, fs)
+
+
+def pm(audio, fs=SR, f0max=1100, f0min=50, time_step=HOP / SR):
+    """F0 frames with their times (s) from parselmouth's autocorrelation tracker"""
+    pitch = parselmouth.Sound(audio, fs).to_pitch_ac(
+        time_step=time_step,
+        voicing_threshold=0.6,
+        pitch_floor=f0min,
+        pitch_ceiling=f0max,
+    )
+    return pitch.selected_array["frequency"], pitch.xs()
+
+
+def _harvest_window(audio, f0max, f0min):
+    return harvest(audio, SR, f0max, f0min, HOP / SR * 1000)
+
+
+def _pm_window(audio, f0max, f0min):
+    f0, xs = pm(audio, SR, f0max, f0min)
+    # Frame k of the full-length curve covers [k, k + 1) * 10 ms, which is
+    # where the centred padding in `VC.get_f0` puts a single-pass frame.
+    # Frames are exactly one hop apart, so one offset places them all.
+    offset = int(np.rint(xs[0] * SR / HOP - 0.5)) if len(xs) else 0
+    return f0, offset + np.arange(len(f0))
+
+
+def pm_grid(audio, f0max=1100, f0min=50):
+    """Single-pass `pm` placed on the same 10 ms grid as `F0Engine.pm`"""
+    f0, index = _pm_window(audio, f0max, f0min)
+    grid = np.zeros(len(audio) // HOP)
+    keep = (index >= 0) & (index < len(grid))
+    grid[index[keep]] = f0[keep]
+    return grid
+
+
+def crossfade(prev, nxt):
+    """Blend two F0 curves over the same frames, linearly from `prev` to `nxt`
+
+    Mixing a voiced value with 0 (unvoiced) would invent a pitch, so there the
+    curve with the larger weight wins instead.
+    """
+    w = np.linspace(0, 1, len(prev))
+    out = (1 - w) * prev + w * nxt
+    hard = (prev == 0) | (nxt == 0)
+    out[hard] = np.where(w[hard] < 0.5, prev[hard], nxt[hard])
+    return out
+
+
+class F0Engine(object):
+    def __init__(self, workers=0, chunk_s=10.0, overlap_s=0.5):
+        self.workers = workers
+        self.chunk = int(chunk_s * SR) // HOP * HOP
+        self.overlap = int(overlap_s * SR) // HOP * HOP
+        self._pool = None
+
+    def configure(self, workers=0, chunk_s=10.0, overlap_s=0.5):
+        self.shutdown()
+        self.__init__(workers, chunk_s, overlap_s)
+
+    def shutdown(self):
+        """Stop the worker processes, `pool()` starts new ones when needed"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def enabled(self, audio):
+        return self.workers > 1 and len(audio) > 2 * self.chunk
+
+    def pool(self):
+        if self._pool is None:
+            # spawn: the parent holds torch/CUDA state that must not be forked
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def windows(self, n):
+        """(start, end) sample ranges, hop aligned, with overlap on each side"""
+        return [
+            (max(s - self.overlap, 0), min(s + self.chunk + self.overlap, n))
+            for s in range(0, n, self.chunk)
+        ]
+
+    def _stitch(self, n_frames, windows, curves):
+        f0 = np.zeros(n_frames)
+        done = 0  # frames of `f0` already final
+        for (start, _), (frames, index) in zip(windows, curves):
+            keep = (index >= 0) & (index < n_frames)
+            frames, index = frames[keep], index[keep]
+            curve = np.zeros(n_frames)
+            curve[index] = frames
+            first, last = index.min(), index.max() + 1
+            if first < done:
+                f0[first:done] = crossfade(f0[first:done], curve[first:done])
+            f0[done:last] = curve[done:last]
+            done = last
+        return f0
+
+    def harvest(self, audio, f0max=1100, f0min=50):
+        """Same curve as `harvest(audio)`: len(audio) // 160 + 1 frames"""
+        windows = self.windows(len(audio))
+        jobs = [
+            self.pool().submit(_harvest_window, audio[s:e], f0max, f0min)
+            for s, e in windows
+        ]
+        curves = []
+        for (s, _), job in zip(windows, jobs):
+            frames = job.result()
+            curves.append((frames, s // HOP + np.arange(len(frames))))
+        return self._stitch(len(audio) // HOP + 1, windows, curves)
+
+    def pm(self, audio, f0max=1100, f0min=50):
+        """Curve on the global 10 ms grid: len(audio) // 160 frames"""
+        windows = self.windows(len(audio))
+        jobs = [
+            self.pool().submit(_pm_window, audio[s:e], f0max, f0min)
+            for s, e in windows
+        ]
+        curves = []
+        for (s, _), job in zip(windows, jobs):
+            frames, index = job.result()
+            curves.append((frames, index + s // HOP))
+        return self._stitch(len(audio) // HOP, windows, curves)
+
+
+f0_engine = F0Engine()
+
+
+def _compare(file, workers=4):
+    from app.rvc.audio import decode_wav
+
+    audio = decode_wav(file, SR).astype(np.double)
+    engine = F0Engine(workers)
+    engine.pool().submit(int).result()  # start the workers outside the timing
+    for name, single, chunked in (
+        ("harvest", lambda: harvest(audio), lambda: engine.harvest(audio)),
+        ("pm", lambda: pm_grid(audio), lambda: engine.pm(audio)),
+    ):
+        t0 = time.time()
+        a = single()
+        t1 = time.time()
+        b = chunked()
+        t2 = time.time()
+        n = min(len(a), len(b))
+        voiced = (a[:n] > 0) & (b[:n] > 0)
+        cents = 1200 * np.abs(np.log2(b[:n][voiced] / a[:n][voiced]))
+        print(
+            f"{name}: single {t1 - t0:.2f}s, {workers} workers {t2 - t1:.2f}s, "
+            f"voicing agreement {np.mean((a[:n] > 0) == (b[:n] > 0)):.4f}, "
+            f"median |diff| {np.median(cents) if len(cents) else 0:.2f} cents"
+        )
+
+
+if __name__ == "__main__":
+    _compare(sys.argv[1], *map(int, sys.argv[2:3]))
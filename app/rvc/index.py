@@ -0,0 +1,278 @@
+"""
+FAISS retrieval indexes shared between requests.
+
+Reading an index and reconstructing its feature matrix (`big_npy`) costs disk
+I/O plus a full pass over the index, so both are cached per index path and
+only reloaded when the mtime of the file or of its sidecar changes.
+
+When `<file>.index.npy` (see `write_sidecar`) is present and up to date, the
+index is opened with faiss' mmap flag and `big_npy` is mapped from the sidecar
+instead of reconstructed, so worker processes share one page-cache copy.
+
+`blend` mixes the retrieved neighbours of each frame without materializing the
+(frames x k x dim) gather, reusing per-thread buffers between calls. With
+`on_device` the blend runs in torch next to the HuBERT features instead.
+
+Compare against the original expression with `python -m benchmarks.index`.
+"""
+
+import os
+import threading
+import traceback
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+import torch
+
+_buffers = threading.local()
+
+
+def _blend_buffers(frames, dim, dtype):
+    """Per-thread (out, row) buffers of at least `frames` rows, grown on demand"""
+    out = getattr(_buffers, "out", None)
+    if (
+        out is None
+        or out.shape[0] < frames
+        or out.shape[1] != dim
+        or out.dtype != dtype
+    ):
+        rows = max(frames, 0 if out is None else out.shape[0])
+        _buffers.out = np.empty((rows, dim), dtype)
+        _buffers.row = np.empty((rows, dim), dtype)
+    return _buffers.out[:frames], _buffers.row[:frames]
+
+
+def blend(big_npy, ix, weight):
+    """`sum_k weight[:, k] * big_npy[ix[:, k]]` one neighbour at a time
+
+    Same result as `np.sum(big_npy[ix] * weight[..., None], axis=1)` up to
+    float rounding. The returned array is a reusable buffer, copy it to keep
+    it past the next call on this thread.
+    """
+    frames, k = ix.shape
+    out, row = _blend_buffers(frames, big_npy.shape[1], big_npy.dtype)
+    # "wrap" keeps numpy's meaning of the -1 faiss returns for missing
+    # neighbours, "raise" would make `take` buffer the output
+    np.take(big_npy, ix[:, 0], axis=0, out=out, mode="wrap")
+    out *= weight[:, :1]
+    for j in range(1, k):
+        np.take(big_npy, ix[:, j], axis=0, out=row, mode="wrap")
+        row *= weight[:, j : j + 1]
+        out += row
+    return out
+
+
+def blend_torch(big, ix, weight):
+    """`blend` as an index_select + bmm on `big`'s device and dtype"""
+    ix = torch.from_numpy(ix).to(big.device)
+    ix = torch.where(ix < 0, ix + big.shape[0], ix)
+    weight = torch.from_numpy(weight).to(big.device, big.dtype)
+    rows = big.index_select(0, ix.view(-1)).view(*ix.shape, -1)
+    return torch.bmm(weight.unsqueeze(1), rows).squeeze(1)
+
+
+def apply_search_params(index, nprobe=0, ef_search=0):
+    """Set IVF `nprobe` / HNSW `efSearch` on `index` where they apply (0 keeps)"""
+    params = faiss.ParameterSpace()
+    if nprobe and faiss.try_extract_index_ivf(index) is not None:
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if ef_search and isinstance(faiss.downcast_index(index), faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", ef_search)
+
+
+def sidecar_path(file_index):
+    return file_index + ".npy"
+
+
+def write_sidecar(file_index):
+    """Save the reconstructed vectors of `file_index` next to it for `read_index`"""
+    index = faiss.read_index(file_index)
+    path = sidecar_path(file_index)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, index.reconstruct_n(0, index.ntotal))
+    os.replace(tmp, path)  # other workers never see a partial file
+    return path
+
+
+def read_index(file_index):
+    """`(index, big_npy)`, memory mapped when an up to date sidecar exists"""
+    sidecar = sidecar_path(file_index)
+    if (
+        os.path.exists(sidecar)
+        and os.path.getmtime(sidecar) >= os.path.getmtime(file_index)
+    ):
+        try:
+            # IVF inverted lists are mapped, other index types read as usual
+            index = faiss.read_index(file_index, faiss.IO_FLAG_MMAP)
+        except RuntimeError:
+            index = faiss.read_index(file_index)
+        big_npy = np.load(sidecar, mmap_mode="r")
+        if big_npy.shape == (index.ntotal, index.d):
+            return index, big_npy
+        print(f"Ignoring {sidecar}: shape {big_npy.shape} does not match the index")
+    elif os.path.exists(sidecar):
+        print(f"Ignoring {sidecar}: older than the index")
+    index = faiss.read_index(file_index)
+    return index, index.reconstruct_n(0, index.ntotal)
+
+
+def index_stamp(file_index):
+    """mtimes of `file_index` and of its sidecar (None when absent)
+
+    A sidecar written after the index was loaded makes the entry stale, so it
+    gets mapped without restarting the worker.
+    """
+    try:
+        sidecar = os.path.getmtime(sidecar_path(file_index))
+    except FileNotFoundError:
+        sidecar = None
+    return os.path.getmtime(file_index), sidecar
+
+
+class IndexCache:
+    """Loaded indexes by path, plus the search settings to use for each
+
+    Settings registered with `configure_index` (e.g. per speaker) override the
+    defaults given to `configure`. An index belongs to one speaker, so its
+    search parameters are set on the shared index object once, when loaded.
+    """
+
+    def __init__(self, max_indexes=16, on_device=False):
+        self.max_indexes = max_indexes
+        self.on_device = on_device
+        self.defaults = {"k": 8, "nprobe": 0, "ef_search": 0}
+        self._settings = {}  # path -> settings overriding `defaults`
+        self._indexes = OrderedDict()  # path -> (stamp, index, big_npy)
+        self._tensors = {}  # (path, device, dtype) -> big_npy on device
+        self._lock = threading.Lock()
+        self._loading = {}  # path -> lock held while that index loads
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, file_index):
+        """Return `(index, big_npy)` for `file_index`, loading it if stale"""
+        stamp = index_stamp(file_index)
+        with self._lock:
+            entry = self._indexes.get(file_index)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                self._indexes.move_to_end(file_index)
+                return entry[1], entry[2]
+            # One loader per index, other indexes keep being served
+            load_lock = self._loading.setdefault(file_index, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._indexes.get(file_index)
+                if entry is not None and entry[0] == stamp:
+                    self.hits += 1
+                    self._indexes.move_to_end(file_index)
+                    return entry[1], entry[2]
+                self.misses += 1
+            index, big_npy = read_index(file_index)
+            with self._lock:
+                settings = self.settings(file_index)
+                apply_search_params(index, settings["nprobe"], settings["ef_search"])
+                self._indexes[file_index] = (stamp, index, big_npy)
+                self._indexes.move_to_end(file_index)
+                self._loading.pop(file_index, None)
+                self._drop_tensors(file_index)
+                while self.max_indexes and len(self._indexes) > self.max_indexes:
+                    path, _ = self._indexes.popitem(last=False)
+                    self._drop_tensors(path)
+                    self.evictions += 1
+        return index, big_npy
+
+    def configure(
+        self, max_indexes=16, on_device=False, k=8, nprobe=0, ef_search=0, threads=0
+    ):
+        """Set the cache size, blend device and default search settings
+
+        `threads` sets faiss' OpenMP thread count, which is process wide.
+        """
+        with self._lock:
+            self.max_indexes = max_indexes
+            self.on_device = on_device
+            self.defaults = {"k": k, "nprobe": nprobe, "ef_search": ef_search}
+            self._tensors.clear()
+            for path, (_, index, _) in self._indexes.items():
+                settings = self.settings(path)
+                apply_search_params(index, settings["nprobe"], settings["ef_search"])
+        if threads > 0:
+            faiss.omp_set_num_threads(threads)
+
+    def configure_index(self, file_index, **settings):
+        """Override `k`, `nprobe` and/or `ef_search` for one index"""
+        unknown = set(settings) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"Unknown index settings: {sorted(unknown)}")
+        with self._lock:
+            self._settings[file_index] = settings
+            entry = self._indexes.get(file_index)
+            if entry is not None:
+                merged = self.settings(file_index)
+                apply_search_params(entry[1], merged["nprobe"], merged["ef_search"])
+
+    def settings(self, file_index):
+        return {**self.defaults, **self._settings.get(file_index, {})}
+
+    def tensor(self, big_npy, device, dtype):
+        """`big_npy` as a torch tensor on `device`, kept while it is cached"""
+        with self._lock:
+            path = next(
+                (p for p, e in self._indexes.items() if e[2] is big_npy), None
+            )
+            key = (path, str(device), dtype)
+            if path is not None and key in self._tensors:
+                return self._tensors[key]
+            if not big_npy.flags.writeable:  # a mapped sidecar
+                big_npy = np.array(big_npy)
+            big = torch.from_numpy(big_npy).to(device, dtype)
+            if path is not None:
+                self._tensors[key] = big
+        return big
+
+    def _drop_tensors(self, path):
+        for key in [k for k in self._tensors if k[0] == path]:
+            del self._tensors[key]
+
+    def invalidate(self, file_index=None):
+        with self._lock:
+            if file_index is None:
+                self._indexes.clear()
+                self._tensors.clear()
+            else:
+                self._indexes.pop(file_index, None)
+                self._drop_tensors(file_index)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "indexes": list(self._indexes),
+                "bytes": sum(e[2].nbytes for e in self._indexes.values()),
+                "mapped": [
+                    p for p, e in self._indexes.items() if isinstance(e[2], np.memmap)
+                ],
+                "device_bytes": sum(
+                    t.numel() * t.element_size() for t in self._tensors.values()
+                ),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "settings": {p: self.settings(p) for p in self._indexes},
+            }
+
+
+index_cache = IndexCache()
+
+
+def load_index(file_index):
+    try:
+        return index_cache.get(file_index)
+    except:
+        traceback.print_exc()
+        return None, None
+
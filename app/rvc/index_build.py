@@ -0,0 +1,133 @@
+"""
+Offline tools for a speaker's FAISS retrieval index.
+
+`convert` rebuilds an index from its reconstructed vectors as HNSW (faster
+search, more memory) or IVF-PQ (compressed vectors, lossy blend), `bench`
+reports recall@k against an exact search and search time per frame for the
+original index and each variant:
+
+    python -m app.rvc.index_build bench models/speaker2/added_*.index
+    python -m app.rvc.index_build convert models/speaker2/added_*.index hnsw
+    python -m app.rvc.index_build sidecar models/speaker2/added_*.index
+
+`convert` replaces the index in place and keeps the original next to it as
+`<file>.orig`, since a speaker folder holds exactly one `.index` file. Search
+settings for the result go in the speaker's retrieval.json. `sidecar` writes
+the `.npy` that lets workers memory map the index (see `app.rvc.index`).
+"""
+
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+
+from app.rvc.index import apply_search_params, sidecar_path, write_sidecar
+
+
+def build(big_npy, kind, nlist=None, hnsw_m=32, pq_m=96, pq_bits=8):
+    """A new `kind` ("flat", "hnsw" or "ivfpq") index holding `big_npy`"""
+    n, d = big_npy.shape
+    nlist = nlist or max(1, int(16 * np.sqrt(n)))
+    if kind == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m)
+    elif kind == "ivfpq":
+        # k-means needs at least 2**bits training points per sub-quantizer
+        pq_bits = min(pq_bits, int(np.log2(n)))
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFPQ(quantizer, d, min(nlist, n), pq_m, pq_bits)
+        index.train(big_npy)
+    else:
+        raise ValueError(f"Unknown index type: {kind}")
+    index.add(big_npy)
+    return index
+
+
+def convert(file_index, kind, output=None, **kwargs):
+    index = faiss.read_index(file_index)
+    big_npy = index.reconstruct_n(0, index.ntotal)
+    nlist = kwargs.pop("nlist", None) or getattr(index, "nlist", None)
+    new = build(big_npy, kind, nlist=nlist, **kwargs)
+    if output is None:
+        output = file_index
+        os.replace(file_index, file_index + ".orig")
+    faiss.write_index(new, output)
+    print(f"Wrote {kind} index with {new.ntotal} vectors to {output}")
+    if os.path.exists(sidecar_path(output)):
+        write_sidecar(output)
+    return output
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    return np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+
+
+def bench(file_index, k=8, frames=2000, noise=0.1, repeat=3):
+    """recall@k and ms/frame of the index and its rebuilt variants
+
+    Queries are stored vectors with Gaussian noise of `noise` times their
+    spread, standing in for HuBERT features of new audio.
+    """
+    index = faiss.read_index(file_index)
+    big_npy = index.reconstruct_n(0, index.ntotal)
+    rng = np.random.default_rng(0)
+    queries = big_npy[rng.integers(0, len(big_npy), frames)]
+    queries = queries + rng.standard_normal(queries.shape).astype(np.float32) * (
+        noise * big_npy.std(axis=0)
+    )
+    _, truth = build(big_npy, "flat").search(queries, k)
+
+    hnsw = build(big_npy, "hnsw")
+    ivfpq = build(big_npy, "ivfpq", nlist=getattr(index, "nlist", None))
+    variants = [(f"original nprobe={n}", index, {"nprobe": n}) for n in (1, 4, 16)]
+    variants += [(f"hnsw efSearch={e}", hnsw, {"ef_search": e}) for e in (16, 64)]
+    variants += [(f"ivfpq nprobe={n}", ivfpq, {"nprobe": n}) for n in (1, 4, 16)]
+    for name, variant, params in variants:
+        apply_search_params(variant, **params)
+        t0 = time.time()
+        for _ in range(repeat):
+            _, found = variant.search(queries, k)
+        ms = (time.time() - t0) / repeat / frames * 1000
+        size = len(faiss.serialize_index(variant))
+        print(
+            f"{name:24s} recall@{k} {recall_at_k(found, truth):.3f}  "
+            f"{ms:.4f} ms/frame  {size / 2**20:.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("convert")
+    p.add_argument("index")
+    p.add_argument("type", choices=["hnsw", "ivfpq", "flat"])
+    p.add_argument("--output")
+    p.add_argument("--nlist", type=int)
+    p.add_argument("--hnsw-m", type=int, default=32)
+    p.add_argument("--pq-m", type=int, default=96)
+    p.add_argument("--pq-bits", type=int, default=8)
+    p = commands.add_parser("sidecar")
+    p.add_argument("index")
+    p = commands.add_parser("bench")
+    p.add_argument("index")
+    p.add_argument("-k", type=int, default=8)
+    p.add_argument("--frames", type=int, default=2000)
+    args = parser.parse_args()
+    if args.command == "convert":
+        convert(
+            args.index,
+            args.type,
+            args.output,
+            nlist=args.nlist,
+            hnsw_m=args.hnsw_m,
+            pq_m=args.pq_m,
+            pq_bits=args.pq_bits,
+        )
+    elif args.command == "sidecar":
+        print(f"Wrote {write_sidecar(args.index)}")
+    else:
+        bench(args.index, args.k, args.frames)
@@ -7,6 +7,9 @@ license: MIT
 
 import copy
 import math
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import torch
 from torch import nn
@@ -17,6 +20,35 @@ from app.rvc.infer_pack import modules
 from app.rvc.infer_pack.modules import LayerNorm
 
 
+# Scores the memory-efficient attention path holds at once, b * h * rows * t
+ATTENTION_CHUNK_ELEMENTS = 2**22
+
+_bands = OrderedDict()
+_bands_lock = threading.Lock()
+
+
+def relative_band(length, window_size, device, max_lengths=16):
+    """Key index of relative positions -w..w for each query, and which exist
+
+    Returns `index` [length, 2w+1] (clamped into range) and `valid` of the
+    same shape, cached for the last `max_lengths` lengths.
+    """
+    key = (length, window_size, device)
+    with _bands_lock:
+        if key in _bands:
+            _bands.move_to_end(key)
+            return _bands[key]
+    offsets = torch.arange(-window_size, window_size + 1, device=device)
+    index = torch.arange(length, device=device)[:, None] + offsets
+    valid = (index >= 0) & (index < length)
+    band = (index.clamp_(0, length - 1), valid)
+    with _bands_lock:
+        _bands[key] = band
+        while len(_bands) > max_lengths:
+            _bands.popitem(last=False)
+    return band
+
+
 class Encoder(nn.Module):
     def __init__(
         self,
@@ -167,6 +199,9 @@ class Decoder(nn.Module):
 
 
 class MultiHeadAttention(nn.Module):
+    # Windowed self-attention at inference goes through `_attention_banded`
+    memory_efficient = True
+
     def __init__(
         self,
         channels,
@@ -237,6 +272,10 @@ class MultiHeadAttention(nn.Module):
         key = key.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
         value = value.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
 
+        if self._banded(t_s, t_t):
+            output = self._attention_banded(query, key, value, mask)
+            return output.transpose(2, 3).contiguous().view(b, d, t_t), None
+
         scores = torch.matmul(query / math.sqrt(self.k_channels), key.transpose(-2, -1))
         if self.window_size is not None:
             assert (
@@ -281,6 +320,53 @@ class MultiHeadAttention(nn.Module):
         )  # [b, n_h, t_t, d_k] -> [b, d, t_t]
         return output, p_attn
 
+    def _banded(self, t_s, t_t):
+        return (
+            self.memory_efficient
+            and self.window_size is not None
+            and t_s == t_t
+            and not self.proximal_bias
+            and self.block_length is None
+            and not (self.training and self.p_dropout > 0)
+            # exports trace the reference path, which has no Python loop
+            and not torch.jit.is_tracing()
+            and not torch.jit.is_scripting()
+        )
+
+    def _attention_banded(self, query, key, value, mask=None):
+        """`attention` without the [b, h, t, 2t-1] relative tensors
+
+        Relative embeddings are zero beyond the window, so the relative logits
+        and weights only exist on a band of 2w+1 keys around each query. They
+        are computed on that band and scattered into / gathered from the
+        scores directly. The scores are built a block of query rows at a time,
+        at most `ATTENTION_CHUNK_ELEMENTS` of them. Returns [b, h, t, d_k].
+        """
+        b, h, t, _ = query.size()
+        query = query / math.sqrt(self.k_channels)
+        index, valid = relative_band(t, self.window_size, query.device)
+        emb_k = self.emb_rel_k.transpose(-2, -1).unsqueeze(0)  # [1, h or 1, d, 2w+1]
+        emb_v = self.emb_rel_v.unsqueeze(0)  # [1, h or 1, 2w+1, d]
+        rows = max(1, ATTENTION_CHUNK_ELEMENTS // (b * h * t))
+        outputs = []
+        for start in range(0, t, rows):
+            end = min(start + rows, t)
+            q = query[:, :, start:end]
+            band = index[start:end].expand(b, h, -1, -1)
+            outside = ~valid[start:end]
+            scores = torch.matmul(q, key.transpose(-2, -1))
+            rel_logits = torch.matmul(q, emb_k).masked_fill_(outside, 0)
+            scores.scatter_add_(-1, band, rel_logits.to(scores.dtype))
+            if mask is not None:
+                scores.masked_fill_(mask[:, :, start:end] == 0, -1e4)
+            p_attn = F.softmax(scores, dim=-1)
+            del scores
+            output = torch.matmul(p_attn, value)
+            relative_weights = p_attn.gather(-1, band).masked_fill_(outside, 0)
+            output = output + torch.matmul(relative_weights, emb_v)
+            outputs.append(output)
+        return torch.cat(outputs, 2) if len(outputs) > 1 else outputs[0]
+
     def _matmul_with_relative_values(self, x, y):
         """
         x: [b, h, l, m]
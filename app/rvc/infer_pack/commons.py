@@ -119,6 +119,16 @@ def fused_add_tanh_sigmoid_multiply(input_a, input_b, n_channels):
     return acts
 
 
+@torch.jit.script
+def fused_tanh_sigmoid_multiply_(in_act, n_channels: int):
+    """`fused_add_tanh_sigmoid_multiply` in place on `in_act`, for inference
+
+    Returns a view of `in_act`, no other tensor is allocated.
+    """
+    t_act = in_act[:, :n_channels, :].tanh_()
+    return t_act.mul_(in_act[:, n_channels:, :].sigmoid_())
+
+
 def convert_pad_shape(pad_shape):
     l = pad_shape[::-1]
     pad_shape = [item for sublist in l for item in sublist]
@@ -150,19 +150,24 @@ class ResidualCouplingBlock(nn.Module):
             )
             self.flows.append(modules.Flip())
 
-    def forward(self, x, x_mask, g=None, reverse=False):
+    def forward(self, x, x_mask, g=None, reverse=False, sid=None):
         if not reverse:
             for flow in self.flows:
-                x, _ = flow(x, x_mask, g=g, reverse=reverse)
+                x, _ = flow(x, x_mask, g=g, reverse=reverse, sid=sid)
         else:
             for flow in reversed(self.flows):
-                x = flow(x, x_mask, g=g, reverse=reverse)
+                x = flow(x, x_mask, g=g, reverse=reverse, sid=sid)
         return x
 
     def remove_weight_norm(self):
         for i in range(self.n_flows):
             self.flows[i * 2].remove_weight_norm()
 
+    def precompute_cond(self, emb_g):
+        """Condition the WN layers on each speaker once per loaded model"""
+        for i in range(self.n_flows):
+            self.flows[i * 2].enc.precompute_cond(emb_g)
+
 
 class PosteriorEncoder(nn.Module):
     def __init__(
@@ -317,6 +322,7 @@ class SineGen(torch.nn.Module):
         self.dim = self.harmonic_num + 1
         self.sampling_rate = samp_rate
         self.voiced_threshold = voiced_threshold
+        self._ramps = {}
 
     def _f02uv(self, f0):
         # generate uv signal
@@ -324,56 +330,51 @@ class SineGen(torch.nn.Module):
         uv = uv * (f0 > self.voiced_threshold)
         return uv
 
+    def _offsets(self, upp, device):
+        """Sample offsets 1..upp within a frame and harmonic multipliers 1..dim"""
+        key = (upp, device)
+        if key not in self._ramps:
+            ramp = torch.arange(1, upp + 1, dtype=torch.float32, device=device)
+            harmonics = torch.arange(1, self.dim + 1, dtype=torch.float32, device=device)
+            self._ramps[key] = (ramp.view(1, 1, upp, 1), harmonics.view(1, 1, 1, -1))
+        return self._ramps[key]
+
     def forward(self, f0, upp):
         """sine_tensor, uv = forward(f0)
-        input F0: tensor(batchsize=1, length, dim=1)
+        input F0: tensor(batchsize=1, length)
                   f0 for unvoiced steps should be 0
-        output sine_tensor: tensor(batchsize=1, length, dim)
-        output uv: tensor(batchsize=1, length, 1)
+        output sine_tensor: tensor(batchsize=1, length * upp, dim)
+        output uv: tensor(batchsize=1, length * upp, 1)
+
+        The phase within a frame is linear, so it is computed per frame and
+        expanded to audio rate once, [b, frames, upp, dim], instead of
+        upsampling and cumsumming at audio rate. Same random draws as before.
         """
         with torch.no_grad():
-            f0 = f0[:, None].transpose(1, 2)
-            f0_buf = torch.zeros(f0.shape[0], f0.shape[1], self.dim, device=f0.device)
-            # fundamental component
-            f0_buf[:, :, 0] = f0[:, :, 0]
-            for idx in np.arange(self.harmonic_num):
-                f0_buf[:, :, idx + 1] = f0_buf[:, :, 0] * (
-                    idx + 2
-                )  # idx + 2: the (idx+1)-th overtone, (idx+2)-th harmonic
-            rad_values = (f0_buf / self.sampling_rate) % 1  ###%1意味着n_har的乘积无法后处理优化
-            rand_ini = torch.rand(
-                f0_buf.shape[0], f0_buf.shape[2], device=f0_buf.device
-            )
+            upp = int(upp)
+            b = f0.shape[0]
+            ramp, harmonics = self._offsets(upp, f0.device)
+            # cycles per sample of every harmonic: [b, frames, 1, dim]
+            rad_values = (f0.float()[:, :, None, None] * harmonics / self.sampling_rate) % 1
+            rand_ini = torch.rand(b, self.dim, device=f0.device)
             rand_ini[:, 0] = 0
-            rad_values[:, 0, :] = rad_values[:, 0, :] + rand_ini
-            tmp_over_one = torch.cumsum(rad_values, 1)  # % 1  #####%1意味着后面的cumsum无法再优化
-            tmp_over_one *= upp
-            tmp_over_one = F.interpolate(
-                tmp_over_one.transpose(2, 1),
-                scale_factor=upp,
-                mode="linear",
-                align_corners=True,
-            ).transpose(2, 1)
-            rad_values = F.interpolate(
-                rad_values.transpose(2, 1), scale_factor=upp, mode="nearest"
-            ).transpose(
-                2, 1
-            )  #######
-            tmp_over_one %= 1
-            tmp_over_one_idx = (tmp_over_one[:, 1:, :] - tmp_over_one[:, :-1, :]) < 0
-            cumsum_shift = torch.zeros_like(rad_values)
-            cumsum_shift[:, 1:, :] = tmp_over_one_idx * -1.0
-            sine_waves = torch.sin(
-                torch.cumsum(rad_values + cumsum_shift, dim=1) * 2 * np.pi
-            )
-            sine_waves = sine_waves * self.sine_amp
-            uv = self._f02uv(f0)
-            uv = F.interpolate(
-                uv.transpose(2, 1), scale_factor=upp, mode="nearest"
-            ).transpose(2, 1)
+            rad_values[:, 0, 0, :] += rand_ini
+            # phase at the start of each frame, accumulated in float64 so it
+            # does not drift over long segments
+            rad_frame = rad_values.double() * upp
+            start = ((torch.cumsum(rad_frame, 1) - rad_frame) % 1).float()
+            phase = ramp * rad_values  # [b, frames, upp, dim]
+            phase += start
+            phase %= 1
+            sine_waves = phase.mul_(2 * np.pi).sin_().mul_(self.sine_amp)
+            uv = self._f02uv(f0.float()[:, :, None, None])  # [b, frames, 1, 1]
             noise_amp = uv * self.noise_std + (1 - uv) * self.sine_amp / 3
-            noise = noise_amp * torch.randn_like(sine_waves)
-            sine_waves = sine_waves * uv + noise
+            sine_waves = sine_waves.view(b, -1, self.dim)
+            noise = torch.randn_like(sine_waves)
+            noise.view(phase.shape).mul_(noise_amp)
+            phase.mul_(uv)  # sine_waves is a view of phase
+            sine_waves += noise
+            uv = uv.expand(-1, -1, upp, -1).reshape(b, -1, 1)
         return sine_waves, uv, noise
 
 
@@ -639,7 +640,7 @@ class SynthesizerTrnMs256NSFsid(nn.Module):
         return o, ids_slice, x_mask, y_mask, (z, z_p, m_p, logs_p, m_q, logs_q)
 
     def infer(self, phone, phone_lengths, pitch, nsff0, sid, rate=None):
-        g = self.emb_g(sid).unsqueeze(-1)
+        g = None if self.emb_g is None else self.emb_g(sid).unsqueeze(-1)
         m_p, logs_p, x_mask = self.enc_p(phone, pitch, phone_lengths)
         z_p = (m_p + torch.exp(logs_p) * torch.randn_like(m_p) * 0.66666) * x_mask
         if rate:
@@ -647,7 +648,7 @@ class SynthesizerTrnMs256NSFsid(nn.Module):
             z_p = z_p[:, :, -head:]
             x_mask = x_mask[:, :, -head:]
             nsff0 = nsff0[:, -head:]
-        z = self.flow(z_p, x_mask, g=g, reverse=True)
+        z = self.flow(z_p, x_mask, g=g, reverse=True, sid=sid)
         o = self.dec(z * x_mask, nsff0, g=g)
         return o, x_mask, (z, z_p, m_p, logs_p)
 
@@ -755,7 +756,7 @@ class SynthesizerTrnMs768NSFsid(nn.Module):
         return o, ids_slice, x_mask, y_mask, (z, z_p, m_p, logs_p, m_q, logs_q)
 
     def infer(self, phone, phone_lengths, pitch, nsff0, sid, rate=None):
-        g = self.emb_g(sid).unsqueeze(-1)
+        g = None if self.emb_g is None else self.emb_g(sid).unsqueeze(-1)
         m_p, logs_p, x_mask = self.enc_p(phone, pitch, phone_lengths)
         z_p = (m_p + torch.exp(logs_p) * torch.randn_like(m_p) * 0.66666) * x_mask
         if rate:
@@ -763,7 +764,7 @@ class SynthesizerTrnMs768NSFsid(nn.Module):
             z_p = z_p[:, :, -head:]
             x_mask = x_mask[:, :, -head:]
             nsff0 = nsff0[:, -head:]
-        z = self.flow(z_p, x_mask, g=g, reverse=True)
+        z = self.flow(z_p, x_mask, g=g, reverse=True, sid=sid)
         o = self.dec(z * x_mask, nsff0, g=g)
         return o, x_mask, (z, z_p, m_p, logs_p)
 
@@ -862,14 +863,14 @@ class SynthesizerTrnMs256NSFsid_nono(nn.Module):
         return o, ids_slice, x_mask, y_mask, (z, z_p, m_p, logs_p, m_q, logs_q)
 
     def infer(self, phone, phone_lengths, sid, rate=None):
-        g = self.emb_g(sid).unsqueeze(-1)
+        g = None if self.emb_g is None else self.emb_g(sid).unsqueeze(-1)
         m_p, logs_p, x_mask = self.enc_p(phone, None, phone_lengths)
         z_p = (m_p + torch.exp(logs_p) * torch.randn_like(m_p) * 0.66666) * x_mask
         if rate:
             head = int(z_p.shape[2] * rate)
             z_p = z_p[:, :, -head:]
             x_mask = x_mask[:, :, -head:]
-        z = self.flow(z_p, x_mask, g=g, reverse=True)
+        z = self.flow(z_p, x_mask, g=g, reverse=True, sid=sid)
         o = self.dec(z * x_mask, g=g)
         return o, x_mask, (z, z_p, m_p, logs_p)
 
@@ -968,14 +969,14 @@ class SynthesizerTrnMs768NSFsid_nono(nn.Module):
         return o, ids_slice, x_mask, y_mask, (z, z_p, m_p, logs_p, m_q, logs_q)
 
     def infer(self, phone, phone_lengths, sid, rate=None):
-        g = self.emb_g(sid).unsqueeze(-1)
+        g = None if self.emb_g is None else self.emb_g(sid).unsqueeze(-1)
         m_p, logs_p, x_mask = self.enc_p(phone, None, phone_lengths)
         z_p = (m_p + torch.exp(logs_p) * torch.randn_like(m_p) * 0.66666) * x_mask
         if rate:
             head = int(z_p.shape[2] * rate)
             z_p = z_p[:, :, -head:]
             x_mask = x_mask[:, :, -head:]
-        z = self.flow(z_p, x_mask, g=g, reverse=True)
+        z = self.flow(z_p, x_mask, g=g, reverse=True, sid=sid)
         o = self.dec(z * x_mask, g=g)
         return o, x_mask, (z, z_p, m_p, logs_p)
 
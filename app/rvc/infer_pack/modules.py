@@ -141,6 +141,9 @@ class DDSConv(nn.Module):
 
 
 class WN(torch.nn.Module):
+    # Without grad, run the in-place `_forward_fused`
+    fused = True
+
     def __init__(
         self,
         hidden_channels,
@@ -158,6 +161,9 @@ class WN(torch.nn.Module):
         self.n_layers = n_layers
         self.gin_channels = gin_channels
         self.p_dropout = p_dropout
+        # Per-speaker `cond_layer` output, see `precompute_cond`. A buffer so
+        # that `.to()` / `.half()` follow the weights, but not saved
+        self.register_buffer("cond_table", None, persistent=False)
 
         self.in_layers = torch.nn.ModuleList()
         self.res_skip_layers = torch.nn.ModuleList()
@@ -192,7 +198,19 @@ class WN(torch.nn.Module):
             res_skip_layer = torch.nn.utils.weight_norm(res_skip_layer, name="weight")
             self.res_skip_layers.append(res_skip_layer)
 
-    def forward(self, x, x_mask, g=None, **kwargs):
+    def precompute_cond(self, emb_g):
+        """Run `cond_layer` over every speaker of `emb_g` once, for inference"""
+        with torch.no_grad():
+            self.cond_table = self.cond_layer(emb_g.weight.unsqueeze(-1))
+
+    def forward(self, x, x_mask, g=None, sid=None, **kwargs):
+        if self.fused and not torch.is_grad_enabled():
+            if sid is not None and self.cond_table is not None:
+                g = self.cond_table[sid]  # [b, 2 * hidden * n_layers, 1]
+            elif g is not None:
+                g = self.cond_layer(g)
+            return self._forward_fused(x, x_mask, g)
+
         output = torch.zeros_like(x)
         n_channels_tensor = torch.IntTensor([self.hidden_channels])
 
@@ -219,6 +237,31 @@ class WN(torch.nn.Module):
                 output = output + res_skip_acts
         return output * x_mask
 
+    def _forward_fused(self, x, x_mask, g):
+        """`forward` without grad: in place, and nothing allocated for g=None
+
+        `g` is the output of `cond_layer` (or None). Dropout is skipped, it is
+        a no-op outside training.
+        """
+        n = self.hidden_channels
+        output = None
+        for i in range(self.n_layers):
+            x_in = self.in_layers[i](x)
+            if g is not None:
+                x_in += g[:, i * 2 * n : (i + 1) * 2 * n, :]
+            acts = commons.fused_tanh_sigmoid_multiply_(x_in, n)
+            res_skip_acts = self.res_skip_layers[i](acts)
+            if i < self.n_layers - 1:
+                res_acts = res_skip_acts[:, :n, :]
+                # the first update copies, x is the caller's tensor
+                x = x + res_acts if i == 0 else x.add_(res_acts)
+                x.mul_(x_mask)
+                skip = res_skip_acts[:, n:, :]
+            else:
+                skip = res_skip_acts
+            output = skip if output is None else output.add_(skip)
+        return output.mul_(x_mask)
+
     def remove_weight_norm(self):
         if self.gin_channels != 0:
             torch.nn.utils.remove_weight_norm(self.cond_layer)
@@ -444,10 +487,10 @@ class ResidualCouplingLayer(nn.Module):
         self.post.weight.data.zero_()
         self.post.bias.data.zero_()
 
-    def forward(self, x, x_mask, g=None, reverse=False):
+    def forward(self, x, x_mask, g=None, reverse=False, sid=None):
         x0, x1 = torch.split(x, [self.half_channels] * 2, 1)
         h = self.pre(x0) * x_mask
-        h = self.enc(h, x_mask, g=g)
+        h = self.enc(h, x_mask, g=g, sid=sid)
         stats = self.post(h) * x_mask
         if not self.mean_only:
             m, logs = torch.split(stats, [self.half_channels] * 2, 1)
@@ -13,7 +13,11 @@ import numpy as np
 import traceback
 import os
 
+import app.rvc.bake
 import app.rvc.config
+import app.rvc.export
+import app.rvc.quantize
+from app.rvc.audio import WAV_EXTENSIONS, decode_wav
 from app.rvc.infer_pack.models import (
     SynthesizerTrnMs256NSFsid,
     SynthesizerTrnMs256NSFsid_nono,
@@ -25,19 +29,23 @@ from app.rvc.vc_infer_pipeline import VC
 config = app.rvc.config.Config()
 
 # https://github.com/RVC-Project/Retrieval-based-Voice-Conversion-WebUI/blob/86ed98aacaa8b2037aad795abd11cdca122cf39f/infer_batch_rvc.py#L126
-def load_hubert(path):
+def load_hubert(path, quantized=False):
     global hubert_model
     models, _, _ = checkpoint_utils.load_model_ensemble_and_task(
         [path],
         suffix="",
     )
-    hubert_model = models[0]
-    hubert_model = hubert_model.to(config.device)
+    model = models[0]
+    model = model.to(config.device)
     if config.is_half:
-        hubert_model = hubert_model.half()
+        model = model.half()
     else:
-        hubert_model = hubert_model.float()
-    hubert_model.eval()
+        model = model.float()
+    model.eval()
+    if quantized:
+        # Not the legacy global, which is the fp32 model
+        return app.rvc.quantize.QuantizedHubert(model)
+    hubert_model = model
     return hubert_model
 
 # https://github.com/RVC-Project/Retrieval-based-Voice-Conversion-WebUI/blob/86ed98aacaa8b2037aad795abd11cdca122cf39f/infer-web.py#L403
@@ -74,13 +82,11 @@ def get_vc(sid, weight_root, to_return_protect0, to_return_protect1):
                 torch.cuda.empty_cache()
             cpt = None
         return {"visible": False, "__type__": "update"}
-    person = "%s/%s" % (weight_root, sid)
-    print("loading %s" % person)
-    cpt = torch.load(person, map_location="cpu")
-    tgt_sr = cpt["config"][-1]
-    cpt["config"][-3] = cpt["weight"]["emb_g.weight"].shape[0]  # n_spk
-    if_f0 = cpt.get("f0", 1)
-    if if_f0 == 0:
+    voice = load_vc(sid, weight_root)
+    net_g, vc, tgt_sr, version = voice.net_g, voice.vc, voice.tgt_sr, voice.version
+    n_spk = voice.n_spk
+    cpt = {"f0": voice.if_f0, "version": voice.version, "config": voice.config}
+    if voice.if_f0 == 0:
         to_return_protect0 = to_return_protect1 = {
             "visible": False,
             "value": 0.5,
@@ -97,34 +103,125 @@ def get_vc(sid, weight_root, to_return_protect0, to_return_protect1):
             "value": to_return_protect1,
             "__type__": "update",
         }
+    return (
+        {"visible": True, "maximum": n_spk, "__type__": "update"},
+        to_return_protect0,
+        to_return_protect1,
+    )
+
+class Voice(object):
+    """A loaded RVC speaker: synthesizer, its `VC` pipeline and metadata"""
+
+    def __init__(self, net_g, vc, tgt_sr, if_f0, version, n_spk, config=None):
+        self.net_g = net_g
+        self.vc = vc
+        self.tgt_sr = tgt_sr
+        self.if_f0 = if_f0
+        self.version = version
+        self.n_spk = n_spk
+        self.config = config
+        # "eager", or the app.rvc.export runtime standing in for net_g
+        self.backend = "eager"
+        # Int8/bf16 CPU synthesizer from app.rvc.quantize
+        self.quantized = False
+        # InferBatcher wrapping net_g when cross-request batching is enabled
+        self.batcher = None
+
+def build_net_g(cpt, is_half):
+    """Synthesizer matching the version and f0 flag of checkpoint `cpt`"""
+    if_f0 = cpt.get("f0", 1)
     version = cpt.get("version", "v1")
     if version == "v1":
         if if_f0 == 1:
-            net_g = SynthesizerTrnMs256NSFsid(*cpt["config"], is_half=config.is_half)
-        else:
-            net_g = SynthesizerTrnMs256NSFsid_nono(*cpt["config"])
+            return SynthesizerTrnMs256NSFsid(*cpt["config"], is_half=is_half)
+        return SynthesizerTrnMs256NSFsid_nono(*cpt["config"])
     elif version == "v2":
         if if_f0 == 1:
-            net_g = SynthesizerTrnMs768NSFsid(*cpt["config"], is_half=config.is_half)
-        else:
-            net_g = SynthesizerTrnMs768NSFsid_nono(*cpt["config"])
+            return SynthesizerTrnMs768NSFsid(*cpt["config"], is_half=is_half)
+        return SynthesizerTrnMs768NSFsid_nono(*cpt["config"])
+
+
+def load_vc(sid, weight_root):
+    """Build the synthesizer for `sid` without touching the module globals"""
+    person = "%s/%s" % (weight_root, sid)
+    print("loading %s" % person)
+    cpt = torch.load(person, map_location="cpu")
+    tgt_sr = cpt["config"][-1]
+    if "emb_g.weight" in cpt["weight"]:  # folded away in baked checkpoints
+        cpt["config"][-3] = cpt["weight"]["emb_g.weight"].shape[0]  # n_spk
+    if_f0 = cpt.get("f0", 1)
+    version = cpt.get("version", "v1")
+    net_g = build_net_g(cpt, config.is_half)
     del net_g.enc_q
-    print(net_g.load_state_dict(cpt["weight"], strict=False))
+    if "baked" in cpt:
+        # Weight norm removed and speaker folded in by app.rvc.bake
+        app.rvc.bake.prepare(net_g, cpt["baked"])
+        print(net_g.load_state_dict(cpt["weight"], strict=True))
+    else:
+        print(net_g.load_state_dict(cpt["weight"], strict=False))
     net_g.eval().to(config.device)
     if config.is_half:
         net_g = net_g.half()
     else:
         net_g = net_g.float()
-    vc = VC(tgt_sr, config)
-    n_spk = cpt["config"][-3]
-    return (
-        {"visible": True, "maximum": n_spk, "__type__": "update"},
-        to_return_protect0,
-        to_return_protect1,
+    if net_g.emb_g is not None:
+        net_g.flow.precompute_cond(net_g.emb_g)
+    return Voice(
+        net_g,
+        VC(tgt_sr, config),
+        tgt_sr,
+        if_f0,
+        version,
+        cpt["config"][-3],
+        cpt["config"],
     )
 
-# https://github.com/RVC-Project/Retrieval-based-Voice-Conversion-WebUI/blob/86ed98aacaa8b2037aad795abd11cdca122cf39f/my_utils.py#L5
+def use_backend(voice, backend, weight_root, sid):
+    """Serve `voice` through `backend` ("eager", "torchscript" or "onnx")
+
+    Exports are CPU float32 and made with `python -m app.rvc.export`. If the
+    export is missing, stale or its runtime is not installed the voice stays
+    on eager.
+    """
+    if backend not in app.rvc.export.BACKENDS:
+        raise ValueError("Unknown synthesizer backend: %s" % backend)
+    if backend == "eager":
+        return voice
+    try:
+        net_g = app.rvc.export.load_backend(backend, "%s/%s" % (weight_root, sid))
+    except (FileNotFoundError, RuntimeError, ImportError) as e:
+        print("%s: keeping the eager synthesizer, %s" % (sid, e))
+        return voice
+    voice.net_g = net_g
+    voice.backend = backend
+    return voice
+
+
+def use_quantized(voice):
+    """Serve `voice` through the int8/bf16 CPU synthesizer (CPU, eager only)"""
+    if config.device != "cpu" or voice.backend != "eager":
+        print("quantized mode needs the eager synthesizer on CPU, skipping")
+        return voice
+    voice.net_g = app.rvc.quantize.QuantizedSynth(voice.net_g)
+    voice.quantized = True
+    return voice
+
+
 def load_audio(file, sr):
+    """Decode WAV in process, other formats through an ffmpeg subprocess"""
+    file = (
+        file.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
+    )  # 防止小白拷路径头尾带了空格和"和回车
+    if file.lower().endswith(WAV_EXTENSIONS):
+        try:
+            return decode_wav(file, sr)
+        except ValueError:
+            # e.g. compressed WAV codecs scipy cannot read
+            pass
+    return load_audio_ffmpeg(file, sr)
+
+# https://github.com/RVC-Project/Retrieval-based-Voice-Conversion-WebUI/blob/86ed98aacaa8b2037aad795abd11cdca122cf39f/my_utils.py#L5
+def load_audio_ffmpeg(file, sr):
     try:
         # https://github.com/openai/whisper/blob/main/whisper/audio.py#L26
         # This launches a subprocess to decode audio while down-mixing and resampling as necessary.
@@ -157,20 +254,28 @@ def vc_single(
     resample_sr,
     rms_mix_rate,
     protect,
+    hubert_model=None,
+    voice=None,
+    audio=None,
+    pipeline_depth=0,
 ):  # spk_item, input_audio0, vc_transform0,f0_file,f0method0
-    global tgt_sr, net_g, vc, hubert_model, version
-    if input_audio_path is None:
+    if hubert_model is None:
+        hubert_model = globals().get("hubert_model")
+    if voice is None:
+        # Fall back to the model last loaded by `get_vc`
+        voice = Voice(net_g, vc, tgt_sr, cpt.get("f0", 1), version, n_spk)
+    if input_audio_path is None and audio is None:
         return "You need to upload an audio", None
     f0_up_key = int(f0_up_key)
     try:
-        audio = load_audio(input_audio_path, 16000)
+        if audio is None:
+            audio = load_audio(input_audio_path, 16000)
         audio_max = np.abs(audio).max() / 0.95
         if audio_max > 1:
-            audio /= audio_max
+            audio = audio / audio_max  # may be a read-only cached TTS waveform
         times = [0, 0, 0]
         if not hubert_model:
-            load_hubert()
-        if_f0 = cpt.get("f0", 1)
+            raise RuntimeError("HuBERT model is not loaded")
         file_index = (
             (
                 file_index.strip(" ")
@@ -186,9 +291,9 @@ def vc_single(
         # file_big_npy = (
         #     file_big_npy.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
         # )
-        audio_opt = vc.pipeline(
+        audio_opt = voice.vc.pipeline(
             hubert_model,
-            net_g,
+            voice.batcher or voice.net_g,
             sid,
             audio,
             input_audio_path,
@@ -198,17 +303,19 @@ def vc_single(
             file_index,
             # file_big_npy,
             index_rate,
-            if_f0,
+            voice.if_f0,
             filter_radius,
-            tgt_sr,
+            voice.tgt_sr,
             resample_sr,
             rms_mix_rate,
-            version,
+            voice.version,
             protect,
             f0_file=f0_file,
+            depth=pipeline_depth,
         )
-        if tgt_sr != resample_sr >= 16000:
-            tgt_sr = resample_sr
+        out_sr = voice.tgt_sr
+        if out_sr != resample_sr >= 16000:
+            out_sr = resample_sr
         index_info = (
             "Using index:%s." % file_index
             if os.path.exists(file_index)
@@ -219,8 +326,52 @@ def vc_single(
             times[0],
             times[1],
             times[2],
-        ), (tgt_sr, audio_opt)
+        ), (out_sr, audio_opt)
     except:
         info = traceback.format_exc()
         print(info)
-        return info, (None, None)
\ No newline at end of file
+        return info, (None, None)
+
+
+def vc_stream(
+    sid,
+    audio,
+    f0_up_key,
+    f0_method,
+    file_index,
+    index_rate,
+    filter_radius,
+    rms_mix_rate,
+    protect,
+    hubert_model,
+    voice,
+    pipeline_depth=0,
+):
+    """Like `vc_single` on 16 kHz `audio`, yielding int16 audio per segment
+
+    Long inputs are split into segments of roughly `x_center` seconds, the
+    first one is yielded before the last has been converted. Errors are raised.
+    """
+    if not hubert_model:
+        raise RuntimeError("HuBERT model is not loaded")
+    audio_max = np.abs(audio).max() / 0.95
+    if audio_max > 1:
+        audio = audio / audio_max
+    yield from voice.vc.pipeline_stream(
+        hubert_model,
+        voice.batcher or voice.net_g,
+        sid,
+        audio,
+        [0, 0, 0],
+        int(f0_up_key),
+        f0_method,
+        file_index,
+        index_rate,
+        voice.if_f0,
+        filter_radius,
+        voice.tgt_sr,
+        rms_mix_rate,
+        voice.version,
+        protect,
+        depth=pipeline_depth,
+    )
@@ -0,0 +1,211 @@
+"""
+Quantized CPU inference for HuBERT and the RVC synthesizer.
+
+On CPU `Config` runs everything in fp32. The quantized mode applies dynamic
+int8 quantization to HuBERT's linear layers and to the attention and FFN
+projections of the synthesizer's text encoder (`attentions.Encoder`), and
+runs the remaining convs under bf16 autocast where the CPU has native bf16.
+The encoder's projections are `Conv1d`s, which `quantize_dynamic` does not
+cover, so they are first rewritten as equivalent `nn.Linear`s.
+
+Measure the quality delta against fp32 with
+
+    python -m app.rvc.quantize models/speaker2/speaker2.pth <dir of wavs>
+"""
+
+import glob
+import os
+import sys
+from contextlib import nullcontext
+
+import numpy as np
+import torch
+from torch import nn
+
+
+def bf16_supported():
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def autocast():
+    if bf16_supported():
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return nullcontext()
+
+
+class ConvAsLinear(nn.Module):
+    """A stride 1, unpadded `Conv1d` as an `nn.Linear` over unfolded frames"""
+
+    def __init__(self, conv):
+        super().__init__()
+        assert conv.stride == (1,) and conv.padding == (0,) and conv.groups == 1
+        self.kernel_size = conv.kernel_size[0]
+        self.dilation = conv.dilation[0]
+        self.linear = nn.Linear(conv.in_channels * self.kernel_size, conv.out_channels)
+        with torch.no_grad():
+            self.linear.weight.copy_(conv.weight.reshape(conv.out_channels, -1))
+            self.linear.bias.copy_(conv.bias)
+
+    def forward(self, x):  # [b, in, t] -> [b, out, t - (k - 1) * dilation]
+        if self.kernel_size > 1:
+            span = (self.kernel_size - 1) * self.dilation + 1
+            x = x.unfold(2, span, 1)[..., :: self.dilation]  # [b, in, t', k]
+            x = x.permute(0, 2, 1, 3).flatten(2)  # [b, t', in * k]
+        else:
+            x = x.transpose(1, 2)
+        return self.linear(x).transpose(1, 2)
+
+
+class FloatInput(nn.Module):
+    """Feeds fp32 to a dynamic int8 linear, which rejects autocast's bf16"""
+
+    def __init__(self, linear):
+        super().__init__()
+        self.linear = linear
+
+    def forward(self, x):
+        return self.linear(x.float())
+
+
+def quantize_linears(model):
+    """Dynamic int8 for every `nn.Linear` in `model`, in place"""
+    torch.quantization.quantize_dynamic(
+        model, {nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+    for parent in list(model.modules()):
+        for name, child in parent.named_children():
+            if isinstance(child, torch.ao.nn.quantized.dynamic.Linear):
+                setattr(parent, name, FloatInput(child))
+    return model
+
+
+def quantize_encoder(encoder):
+    """Int8 attention and FFN projections for an `attentions.Encoder`"""
+    for attn in encoder.attn_layers:
+        for name in ("conv_q", "conv_k", "conv_v", "conv_o"):
+            setattr(attn, name, ConvAsLinear(getattr(attn, name)))
+    for ffn in encoder.ffn_layers:
+        ffn.conv_1 = ConvAsLinear(ffn.conv_1)
+        ffn.conv_2 = ConvAsLinear(ffn.conv_2)
+    return quantize_linears(encoder)
+
+
+class QuantizedSynth(object):
+    """Stands in for `net_g`: int8 text encoder, bf16 autocast elsewhere"""
+
+    def __init__(self, net_g):
+        quantize_encoder(net_g.enc_p.encoder)
+        self.net_g = net_g
+
+    def infer(self, *args):
+        with torch.no_grad(), autocast():
+            o = self.net_g.infer(*args)
+        return (o[0].float(),) + tuple(o[1:])
+
+    def parameters(self):
+        return self.net_g.parameters()
+
+    def buffers(self):
+        return self.net_g.buffers()
+
+    def state_dict(self, **kwargs):
+        return self.net_g.state_dict(**kwargs)
+
+
+class QuantizedHubert(object):
+    """Int8 HuBERT whose `extract_features` runs under bf16 autocast
+
+    Quantizes `model` in place, so give it its own instance rather than the
+    shared fp32 model (`load_hubert(path, quantized=True)` does).
+    """
+
+    def __init__(self, model):
+        for module in model.modules():
+            # fairseq's attention fast path passes the q/k/v/out weights to
+            # F.multi_head_attention_forward, which int8 linears do not have
+            if hasattr(module, "q_proj") and hasattr(module, "onnx_trace"):
+                module.prepare_for_onnx_export_()
+        self.model = quantize_linears(model)
+
+    def extract_features(self, **inputs):
+        with torch.no_grad(), autocast():
+            logits = self.model.extract_features(**inputs)
+        return (logits[0].float(),) + tuple(logits[1:])
+
+    def final_proj(self, x):
+        return self.model.final_proj(x)
+
+    def parameters(self):
+        return self.model.parameters()
+
+    def buffers(self):
+        return self.model.buffers()
+
+    def state_dict(self, **kwargs):
+        return self.model.state_dict(**kwargs)
+
+
+def snr_db(ref, out):
+    n = min(len(ref), len(out))
+    ref, out = ref[:n].astype(np.float64), out[:n].astype(np.float64)
+    return 10 * np.log10(np.sum(ref**2) / max(np.sum((ref - out) ** 2), 1e-12))
+
+
+def log_mel_distance(ref, out, sr):
+    import librosa
+
+    n = min(len(ref), len(out))
+    mels = [
+        np.log(librosa.feature.melspectrogram(y=y[:n], sr=sr) + 1e-5)
+        for y in (ref.astype(np.float32), out.astype(np.float32))
+    ]
+    return float(np.mean(np.abs(mels[0] - mels[1])))
+
+
+def _evaluate(weight_path, wav_dir):
+    """SNR and log-mel distance of quantized vs fp32 output per test file"""
+    from app.rvc.export import no_noise
+    from app.rvc.misc import load_audio, load_vc, vc_single
+    from app.rvc.registry import registry
+
+    sid = os.path.basename(weight_path)
+    fp32 = load_vc(sid, os.path.dirname(weight_path))
+    quantized = load_vc(sid, os.path.dirname(weight_path))
+    quantized.net_g = QuantizedSynth(quantized.net_g)
+    hubert = registry.hubert()
+    hubert_q = registry.hubert(quantized=True)
+    print(f"bf16 autocast: {bf16_supported()}")
+    for wav in sorted(glob.glob(os.path.join(wav_dir, "*.wav"))):
+        audio = load_audio(wav, 16000)
+        outputs = []
+        for voice, model in ((fp32, hubert), (quantized, hubert_q)):
+            with no_noise():
+                info, (sr, out) = vc_single(
+                    0,
+                    None,
+                    0,
+                    None,
+                    "pm",
+                    "",
+                    "",
+                    0,
+                    3,
+                    0,
+                    1,
+                    0.33,
+                    hubert_model=model,
+                    voice=voice,
+                    audio=audio.copy(),
+                )
+            outputs.append(out / 32768.0)
+        print(
+            f"{os.path.basename(wav)}: SNR {snr_db(*outputs):.1f} dB, "
+            f"log-mel L1 {log_mel_distance(*outputs, sr):.3f}"
+        )
+
+
+if __name__ == "__main__":
+    _evaluate(*sys.argv[1:3])
@@ -0,0 +1,305 @@
+"""
+Process-wide registry for the models shared by every request.
+
+The HuBERT content encoder is speaker independent, so it is loaded once (at
+startup or on first use) and handed out to every threadpool worker instead of
+being rebuilt from the fairseq checkpoint per request. RVC voices are kept in
+an LRU cache bounded by a count and a byte budget.
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import huggingface_hub
+import torch
+from structlog import get_logger
+
+from app.rvc.batching import FeatureBatcher, InferBatcher
+from app.rvc.misc import config as rvc_config
+from app.rvc.misc import load_hubert, load_vc, use_backend, use_quantized
+
+log = get_logger(__name__)
+
+HUBERT_REPO_ID = "lj1995/VoiceConversionWebUI"
+HUBERT_FILENAME = "hubert_base.pt"
+HUBERT_REVISION = "1c75048c96f23f99da4b12909b532b5983290d7d"
+
+
+def module_nbytes(module):
+    """Bytes held by the tensors of a torch module
+
+    Walks `state_dict()` rather than `parameters()`, which miss the packed
+    weights of dynamic int8 linears, plus the non-persistent buffers.
+    """
+    if hasattr(module, "nbytes"):  # e.g. an ONNX Runtime session
+        return module.nbytes
+    values = list(module.state_dict(keep_vars=True).values())
+    tensors = {}
+    for value in values + list(module.buffers()):
+        # int8 linears store their weight and bias as a `_packed_params` tuple
+        for t in value if isinstance(value, tuple) else (value,):
+            if isinstance(t, torch.Tensor):
+                tensors[id(t)] = t
+    return sum(t.numel() * t.element_size() for t in tensors.values())
+
+
+def download_hubert(local_dir="models/hubert/"):
+    return huggingface_hub.hf_hub_download(
+        repo_id=HUBERT_REPO_ID,
+        filename=HUBERT_FILENAME,
+        revision=HUBERT_REVISION,
+        local_dir=local_dir,
+        local_dir_use_symlinks=True,
+    )
+
+
+class VoiceCache:
+    """LRU cache of loaded RVC voices keyed by speaker id
+
+    Holds at most `max_voices` voices and, when `max_bytes` is set, no more
+    than that many bytes of synthesizer weights. Pinned speakers are never
+    evicted. A voice evicted while a request is still using it stays alive
+    until that request drops its reference.
+    """
+
+    def __init__(
+        self,
+        weight_root=None,
+        max_voices=8,
+        max_bytes=0,
+        pinned=(),
+        max_batch=1,
+        max_wait_ms=10,
+        backend="eager",
+        backends=None,
+        quantized=(),
+    ):
+        self.weight_root = weight_root
+        self.max_voices = max_voices
+        self.max_bytes = max_bytes
+        self.pinned = set(pinned)
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        # Synthesizer runtime, "eager", "torchscript" or "onnx", per speaker id
+        self.backend = backend
+        self.backends = dict(backends or {})
+        # Speaker ids served by the int8/bf16 CPU synthesizer
+        self.quantized = set(quantized)
+        self._holds = Counter()
+        self._voices = OrderedDict()
+        self._nbytes = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, sid):
+        with self._lock:
+            if sid in self._voices:
+                self.hits += 1
+                self._voices.move_to_end(sid)
+                return self._voices[sid]
+            # One loader per speaker, other speakers keep being served
+            load_lock = self._loading.setdefault(sid, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if sid in self._voices:
+                    self.hits += 1
+                    self._voices.move_to_end(sid)
+                    return self._voices[sid]
+                self.misses += 1
+            voice = load_vc(sid, self.weight_root)
+            backend = self.backends.get(sid, self.backend)
+            voice = use_backend(voice, backend, self.weight_root, sid)
+            if sid in self.quantized:
+                voice = use_quantized(voice)
+            if self.max_batch > 1:
+                voice.batcher = InferBatcher(
+                    voice.net_g, self.max_batch, self.max_wait_ms
+                )
+            with self._lock:
+                self._voices[sid] = voice
+                self._nbytes[sid] = module_nbytes(voice.net_g)
+                self._loading.pop(sid, None)
+                self._evict()
+        return voice
+
+    def pin(self, sid):
+        """Keep `sid` resident regardless of the budget, loading it now"""
+        self.pinned.add(sid)
+        return self.get(sid)
+
+    def unpin(self, sid):
+        self.pinned.discard(sid)
+        with self._lock:
+            self._evict()
+
+    def hold(self, sid):
+        """Keep `sid` resident until a matching `release`, e.g. for a session"""
+        with self._lock:
+            self._holds[sid] += 1
+        return self.get(sid)
+
+    def release(self, sid):
+        with self._lock:
+            self._holds[sid] -= 1
+            if self._holds[sid] <= 0:
+                del self._holds[sid]
+            self._evict()
+
+    @property
+    def nbytes(self):
+        return sum(self._nbytes.values())
+
+    def _over_budget(self):
+        if self.max_voices and len(self._voices) > self.max_voices:
+            return True
+        return bool(self.max_bytes) and self.nbytes > self.max_bytes
+
+    def _evict(self):
+        while self._over_budget():
+            # Least recently used first, never the voice just requested
+            victims = [
+                sid
+                for sid in list(self._voices)[:-1]
+                if sid not in self.pinned and sid not in self._holds
+            ]
+            if not victims:
+                break
+            sid = victims[0]
+            del self._voices[sid]
+            del self._nbytes[sid]
+            self.evictions += 1
+            log.info(f"Evicted RVC voice {sid}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "voices": list(self._voices),
+                "pinned": sorted(self.pinned),
+                "held": dict(self._holds),
+                "bytes": self.nbytes,
+                "max_voices": self.max_voices,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "backends": {sid: v.backend for sid, v in self._voices.items()},
+                "quantized": [sid for sid, v in self._voices.items() if v.quantized],
+                "batching": {
+                    sid: voice.batcher.stats()
+                    for sid, voice in self._voices.items()
+                    if voice.batcher is not None
+                },
+            }
+
+
+class ModelRegistry:
+    def __init__(self, hubert_dir="models/hubert/"):
+        self.hubert_dir = hubert_dir
+        self._lock = threading.Lock()
+        self._hubert = None
+        self._hubert_quantized = None
+        self.hubert_load_s = None
+        self.hubert_nbytes = 0
+        self.hubert_batch = 1
+        self.hubert_wait_ms = 10
+        self._features = None
+        self.voices = VoiceCache()
+
+    def configure_voices(
+        self,
+        weight_root,
+        max_voices=8,
+        max_bytes=0,
+        pinned=(),
+        max_batch=1,
+        max_wait_ms=10,
+        backend="eager",
+        backends=None,
+        quantized=(),
+    ):
+        self.voices.weight_root = weight_root
+        self.voices.max_voices = max_voices
+        self.voices.max_bytes = max_bytes
+        self.voices.pinned = set(pinned)
+        self.voices.max_batch = max_batch
+        self.voices.max_wait_ms = max_wait_ms
+        self.voices.backend = backend
+        self.voices.backends = dict(backends or {})
+        self.voices.quantized = set(quantized)
+
+    def voice(self, sid):
+        return self.voices.get(sid)
+
+    def configure_features(self, max_batch=1, max_wait_ms=10):
+        self.hubert_batch = max_batch
+        self.hubert_wait_ms = max_wait_ms
+
+    def features(self, quantized=False):
+        """HuBERT for `VC.vc`, wrapped in a FeatureBatcher when batching is on
+
+        `quantized` (for voices with `Voice.quantized`) gives the int8/bf16
+        CPU model instead, unbatched.
+        """
+        if quantized and rvc_config.device == "cpu":
+            return self.hubert(quantized=True)
+        hubert_model = self.hubert()
+        if self.hubert_batch <= 1:
+            return hubert_model
+        with self._lock:
+            if self._features is None:
+                self._features = FeatureBatcher(
+                    hubert_model, self.hubert_batch, self.hubert_wait_ms
+                )
+        return self._features
+
+    def hubert(self, quantized=False):
+        """Return the shared HuBERT model, loading it on first use
+
+        The model is only read during inference (`eval()` + `no_grad`), so a
+        single instance is safe to share between threadpool workers. The lock
+        only guards the one-off load. The quantized model is a separate copy,
+        loaded the first time a quantized voice needs it.
+        """
+        if quantized:
+            if self._hubert_quantized is None:
+                with self._lock:
+                    if self._hubert_quantized is None:
+                        path = download_hubert(self.hubert_dir)
+                        self._hubert_quantized = load_hubert(path, quantized=True)
+                        log.info("Loaded int8 HuBERT")
+            return self._hubert_quantized
+        if self._hubert is not None:
+            return self._hubert
+        with self._lock:
+            if self._hubert is None:
+                t0 = time.time()
+                path = download_hubert(self.hubert_dir)
+                model = load_hubert(path)
+                self.hubert_load_s = time.time() - t0
+                self.hubert_nbytes = module_nbytes(model)
+                self._hubert = model
+                log.info(
+                    f"Loaded HuBERT in {self.hubert_load_s:.2f}s "
+                    f"({self.hubert_nbytes / 1024 / 1024:.0f} MiB)"
+                )
+        return self._hubert
+
+    def stats(self):
+        return {
+            "hubert": {
+                "loaded": self._hubert is not None,
+                "load_s": self.hubert_load_s,
+                "bytes": self.hubert_nbytes,
+                "batching": self._features.stats() if self._features else None,
+                "quantized_loaded": self._hubert_quantized is not None,
+            },
+            "voices": self.voices.stats(),
+        }
+
+
+registry = ModelRegistry()
@@ -8,29 +8,76 @@ import numpy as np, parselmouth, torch, pdb, sys, os
 from time import time as ttime
 import torch.nn.functional as F
 import scipy.signal as signal
-import pyworld, os, traceback, faiss, librosa, torchcrepe
+import os, traceback, librosa, torchcrepe
 from scipy import signal
-from functools import lru_cache
+import hashlib, queue, threading
+from collections import OrderedDict
+from app.rvc import f0 as f0_mod
+from app.rvc.batching import FeatureBatcher
+from app.rvc.f0 import f0_engine
+from app.rvc.index import blend, blend_torch, index_cache, load_index
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 
 bh, ah = signal.butter(N=5, Wn=48, btype="high", fs=16000)
 
-input_audio_path2wav = {}
 
+class F0Cache(object):
+    """Size-bounded LRU of F0 curves keyed by audio content and F0 parameters"""
 
-@lru_cache
-def cache_harvest_f0(input_audio_path, fs, f0max, f0min, frame_period):
-    audio = input_audio_path2wav[input_audio_path]
-    f0, t = pyworld.harvest(
-        audio,
-        fs=fs,
-        f0_ceil=f0max,
-        f0_floor=f0min,
-        frame_period=frame_period,
-    )
-    f0 = pyworld.stonemask(audio, f0, t, fs)
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._f0 = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(audio, *params):
+        return (hashlib.sha1(audio.tobytes()).hexdigest(), audio.shape[0]) + params
+
+    def get(self, key):
+        with self._lock:
+            f0 = self._f0.get(key)
+            if f0 is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._f0.move_to_end(key)
+            # Callers scale the curve in place
+            return f0.copy()
+
+    def put(self, key, f0):
+        with self._lock:
+            self._f0[key] = f0.copy()
+            while len(self._f0) > self.max_entries:
+                self._f0.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._f0),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+harvest_f0_cache = F0Cache()
+
+
+def cache_harvest_f0(audio, fs, f0max, f0min, frame_period):
+    audio = np.ascontiguousarray(audio, dtype=np.double)
+    key = F0Cache.key(audio, fs, f0max, f0min, frame_period)
+    f0 = harvest_f0_cache.get(key)
+    if f0 is not None:
+        return f0
+    if fs == f0_mod.SR and frame_period == 10 and f0_engine.enabled(audio):
+        f0 = f0_engine.harvest(audio, f0max, f0min)
+    else:
+        f0 = f0_mod.harvest(audio, fs, f0max, f0min, frame_period)
+    harvest_f0_cache.put(key, f0)
     return f0
 
 
@@ -56,6 +103,30 @@ def change_rms(data1, sr1, data2, sr2, rate):  # 1是输入音频，2是输出
     return data2
 
 
+def split_points(audio_pad, n, window, t_center, t_query):
+    """Cut points for long inputs
+
+    For every multiple `t` of `t_center` below `n`, the sample within
+    `t_query` of `t` where the `window`-sample moving sum of `audio_pad` (the
+    audio reflect-padded by `window // 2` each side) is closest to zero.
+    """
+    csum = np.concatenate(([0.0], np.cumsum(audio_pad)))
+    audio_sum = np.abs(csum[window : window + n] - csum[:n])
+    centers = np.arange(t_center, n, t_center)
+    if len(centers) == 0:
+        return []
+    # Search windows may run past the end, pad so they never win there
+    audio_sum = np.concatenate((audio_sum, np.full(t_query, np.inf)))
+    # [len(centers), 2 * t_query] view of every search window, no copy
+    windows = np.lib.stride_tricks.as_strided(
+        audio_sum[t_center - t_query :],
+        shape=(len(centers), 2 * t_query),
+        strides=(t_center * audio_sum.strides[0], audio_sum.strides[0]),
+        writeable=False,
+    )
+    return (centers - t_query + np.argmin(windows, axis=1)).tolist()
+
+
 class VC(object):
     def __init__(self, tgt_sr, config):
         self.x_pad, self.x_query, self.x_center, self.x_max, self.is_half = (
@@ -85,31 +156,32 @@ class VC(object):
         filter_radius,
         inp_f0=None,
     ):
-        global input_audio_path2wav
         time_step = self.window / self.sr * 1000
         f0_min = 50
         f0_max = 1100
         f0_mel_min = 1127 * np.log(1 + f0_min / 700)
         f0_mel_max = 1127 * np.log(1 + f0_max / 700)
         if f0_method == "pm":
-            f0 = (
-                parselmouth.Sound(x, self.sr)
-                .to_pitch_ac(
-                    time_step=time_step / 1000,
-                    voicing_threshold=0.6,
-                    pitch_floor=f0_min,
-                    pitch_ceiling=f0_max,
+            if f0_engine.enabled(x):
+                f0 = f0_engine.pm(x, f0_max, f0_min)
+            else:
+                f0 = (
+                    parselmouth.Sound(x, self.sr)
+                    .to_pitch_ac(
+                        time_step=time_step / 1000,
+                        voicing_threshold=0.6,
+                        pitch_floor=f0_min,
+                        pitch_ceiling=f0_max,
+                    )
+                    .selected_array["frequency"]
                 )
-                .selected_array["frequency"]
-            )
             pad_size = (p_len - len(f0) + 1) // 2
             if pad_size > 0 or p_len - len(f0) - pad_size > 0:
                 f0 = np.pad(
                     f0, [[pad_size, p_len - len(f0) - pad_size]], mode="constant"
                 )
         elif f0_method == "harvest":
-            input_audio_path2wav[input_audio_path] = x.astype(np.double)
-            f0 = cache_harvest_f0(input_audio_path, self.sr, f0_max, f0_min, 10)
+            f0 = cache_harvest_f0(x, self.sr, f0_max, f0_min, 10)
             if filter_radius > 2:
                 f0 = signal.medfilt(f0, 3)
         elif f0_method == "crepe":
@@ -167,21 +239,23 @@ class VC(object):
         f0_coarse = np.rint(f0_mel).astype(np.int)
         return f0_coarse, f0bak  # 1-0
 
-    def vc(
+    def features(
         self,
         model,
-        net_g,
-        sid,
         audio0,
-        pitch,
-        pitchf,
-        times,
         index,
         big_npy,
         index_rate,
         version,
-        protect,
-    ):  # ,file_index,file_big_npy
+        keep_raw,
+        times,
+        k=8,
+    ):
+        """HuBERT features of `audio0` blended with the index, at 2x frame rate
+
+        Returns the blended features and, when `keep_raw`, the unblended ones
+        used by `protect`. Does not depend on F0, so it can run ahead of it.
+        """
         feats = torch.from_numpy(audio0)
         if self.is_half:
             feats = feats.half()
@@ -200,10 +274,12 @@ class VC(object):
         }
         t0 = ttime()
         with torch.no_grad():
-            logits = model.extract_features(**inputs)
-            feats = model.final_proj(logits[0]) if version == "v1" else logits[0]
-        if protect < 0.5 and pitch != None and pitchf != None:
-            feats0 = feats.clone()
+            if isinstance(model, FeatureBatcher):
+                feats = model.extract(inputs["source"], version)
+            else:
+                logits = model.extract_features(**inputs)
+                feats = model.final_proj(logits[0]) if version == "v1" else logits[0]
+        feats0 = feats.clone() if keep_raw else None
         if (
             isinstance(index, type(None)) == False
             and isinstance(big_npy, type(None)) == False
@@ -216,23 +292,31 @@ class VC(object):
             # _, I = index.search(npy, 1)
             # npy = big_npy[I.squeeze()]
 
-            score, ix = index.search(npy, k=8)
+            score, ix = index.search(npy, k=k)
             weight = np.square(1 / score)
             weight /= weight.sum(axis=1, keepdims=True)
-            npy = np.sum(big_npy[ix] * np.expand_dims(weight, axis=2), axis=1)
-
-            if self.is_half:
-                npy = npy.astype("float16")
-            feats = (
-                torch.from_numpy(npy).unsqueeze(0).to(self.device) * index_rate
-                + (1 - index_rate) * feats
-            )
+            if index_cache.on_device:
+                big = index_cache.tensor(big_npy, feats.device, feats.dtype)
+                retrieved = blend_torch(big, ix, weight)
+            else:
+                npy = blend(big_npy, ix, weight)
+                if self.is_half:
+                    npy = npy.astype("float16")
+                retrieved = torch.from_numpy(npy).to(self.device)
+            feats = retrieved.unsqueeze(0) * index_rate + (1 - index_rate) * feats
 
         feats = F.interpolate(feats.permute(0, 2, 1), scale_factor=2).permute(0, 2, 1)
-        if protect < 0.5 and pitch != None and pitchf != None:
+        if keep_raw:
             feats0 = F.interpolate(feats0.permute(0, 2, 1), scale_factor=2).permute(
                 0, 2, 1
             )
+        del padding_mask
+        times[0] += ttime() - t0
+        return feats, feats0
+
+    def synthesize(
+        self, net_g, sid, audio0, feats, feats0, pitch, pitchf, protect, times
+    ):
         t1 = ttime()
         p_len = audio0.shape[0] // self.window
         if feats.shape[1] < p_len:
@@ -261,15 +345,58 @@ class VC(object):
                 audio1 = (
                     (net_g.infer(feats, p_len, sid)[0][0, 0]).data.cpu().float().numpy()
                 )
-        del feats, p_len, padding_mask
+        del feats, p_len
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
-        t2 = ttime()
-        times[0] += t1 - t0
-        times[2] += t2 - t1
+        times[2] += ttime() - t1
         return audio1
 
-    def pipeline(
+    def vc(
+        self,
+        model,
+        net_g,
+        sid,
+        audio0,
+        pitch,
+        pitchf,
+        times,
+        index,
+        big_npy,
+        index_rate,
+        version,
+        protect,
+    ):  # ,file_index,file_big_npy
+        keep_raw = protect < 0.5 and pitch != None and pitchf != None
+        feats, feats0 = self.features(
+            model, audio0, index, big_npy, index_rate, version, keep_raw, times
+        )
+        return self.synthesize(
+            net_g, sid, audio0, feats, feats0, pitch, pitchf, protect, times
+        )
+
+    def segments(self, audio_pad, opt_ts):
+        """(audio start, audio end, first frame, end frame) of each segment
+
+        Ranges index the `t_pad` padded audio and its F0 frames, an end of
+        None runs to the end of the input.
+        """
+        bounds = []
+        s = 0
+        for t in opt_ts:
+            t = t // self.window * self.window
+            bounds.append(
+                (
+                    s,
+                    t + self.t_pad2 + self.window,
+                    s // self.window,
+                    (t + self.t_pad2) // self.window,
+                )
+            )
+            s = t
+        bounds.append((s, None, s // self.window, None))
+        return bounds
+
+    def convert_segments(
         self,
         model,
         net_g,
@@ -280,17 +407,21 @@ class VC(object):
         f0_up_key,
         f0_method,
         file_index,
-        # file_big_npy,
         index_rate,
         if_f0,
         filter_radius,
-        tgt_sr,
-        resample_sr,
-        rms_mix_rate,
         version,
         protect,
         f0_file=None,
+        depth=0,
     ):
+        """Yield (output, source range) for each segment of high-passed `audio`
+
+        Outputs are float32 at the model's rate, source ranges are the samples
+        of `audio` they were converted from. With `depth` > 0 HuBERT features
+        and index retrieval run on a worker thread, starting while F0 is being
+        extracted and staying up to `depth` segments ahead of the synthesizer.
+        """
         if (
             file_index != ""
             # and file_big_npy != ""
@@ -298,140 +429,134 @@ class VC(object):
             and os.path.exists(file_index) == True
             and index_rate != 0
         ):
-            try:
-                index = faiss.read_index(file_index)
-                # big_npy = np.load(file_big_npy)
-                big_npy = index.reconstruct_n(0, index.ntotal)
-            except:
-                traceback.print_exc()
-                index = big_npy = None
+            # big_npy = np.load(file_big_npy)
+            index, big_npy = load_index(file_index)
+            k = index_cache.settings(file_index)["k"]
         else:
-            index = big_npy = None
-        audio = signal.filtfilt(bh, ah, audio)
+            index = big_npy = k = None
         audio_pad = np.pad(audio, (self.window // 2, self.window // 2), mode="reflect")
         opt_ts = []
         if audio_pad.shape[0] > self.t_max:
-            audio_sum = np.zeros_like(audio)
-            for i in range(self.window):
-                audio_sum += audio_pad[i : i - self.window]
-            for t in range(self.t_center, audio.shape[0], self.t_center):
-                opt_ts.append(
-                    t
-                    - self.t_query
-                    + np.where(
-                        np.abs(audio_sum[t - self.t_query : t + self.t_query])
-                        == np.abs(audio_sum[t - self.t_query : t + self.t_query]).min()
-                    )[0][0]
-                )
-        s = 0
-        audio_opt = []
-        t = None
-        t1 = ttime()
-        audio_pad = np.pad(audio, (self.t_pad, self.t_pad), mode="reflect")
-        p_len = audio_pad.shape[0] // self.window
-        inp_f0 = None
-        if hasattr(f0_file, "name") == True:
-            try:
-                with open(f0_file.name, "r") as f:
-                    lines = f.read().strip("\n").split("\n")
-                inp_f0 = []
-                for line in lines:
-                    inp_f0.append([float(i) for i in line.split(",")])
-                inp_f0 = np.array(inp_f0, dtype="float32")
-            except:
-                traceback.print_exc()
-        sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
-        pitch, pitchf = None, None
-        if if_f0 == 1:
-            pitch, pitchf = self.get_f0(
-                input_audio_path,
-                audio_pad,
-                p_len,
-                f0_up_key,
-                f0_method,
-                filter_radius,
-                inp_f0,
+            opt_ts = split_points(
+                audio_pad, audio.shape[0], self.window, self.t_center, self.t_query
             )
-            pitch = pitch[:p_len]
-            pitchf = pitchf[:p_len]
-            if self.device == "mps":
-                pitchf = pitchf.astype(np.float32)
-            pitch = torch.tensor(pitch, device=self.device).unsqueeze(0).long()
-            pitchf = torch.tensor(pitchf, device=self.device).unsqueeze(0).float()
-        t2 = ttime()
-        times[1] += t2 - t1
-        for t in opt_ts:
-            t = t // self.window * self.window
+        audio_pad = np.pad(audio, (self.t_pad, self.t_pad), mode="reflect")
+        bounds = self.segments(audio_pad, opt_ts)
+        keep_raw = protect < 0.5 and if_f0 == 1
+        feats = prefetch(
+            lambda b: self.features(
+                model,
+                audio_pad[b[0] : b[1]],
+                index,
+                big_npy,
+                index_rate,
+                version,
+                keep_raw,
+                times,
+                k,
+            ),
+            bounds,
+            depth,
+        )
+        try:
+            t1 = ttime()
+            p_len = audio_pad.shape[0] // self.window
+            inp_f0 = None
+            if hasattr(f0_file, "name") == True:
+                try:
+                    with open(f0_file.name, "r") as f:
+                        lines = f.read().strip("\n").split("\n")
+                    inp_f0 = []
+                    for line in lines:
+                        inp_f0.append([float(i) for i in line.split(",")])
+                    inp_f0 = np.array(inp_f0, dtype="float32")
+                except:
+                    traceback.print_exc()
+            sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
+            pitch, pitchf = None, None
             if if_f0 == 1:
-                audio_opt.append(
-                    self.vc(
-                        model,
-                        net_g,
-                        sid,
-                        audio_pad[s : t + self.t_pad2 + self.window],
-                        pitch[:, s // self.window : (t + self.t_pad2) // self.window],
-                        pitchf[:, s // self.window : (t + self.t_pad2) // self.window],
-                        times,
-                        index,
-                        big_npy,
-                        index_rate,
-                        version,
-                        protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
-                )
-            else:
-                audio_opt.append(
-                    self.vc(
-                        model,
-                        net_g,
-                        sid,
-                        audio_pad[s : t + self.t_pad2 + self.window],
-                        None,
-                        None,
-                        times,
-                        index,
-                        big_npy,
-                        index_rate,
-                        version,
-                        protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
+                pitch, pitchf = self.get_f0(
+                    input_audio_path,
+                    audio_pad,
+                    p_len,
+                    f0_up_key,
+                    f0_method,
+                    filter_radius,
+                    inp_f0,
                 )
-            s = t
-        if if_f0 == 1:
-            audio_opt.append(
-                self.vc(
-                    model,
+                pitch = pitch[:p_len]
+                pitchf = pitchf[:p_len]
+                if self.device == "mps":
+                    pitchf = pitchf.astype(np.float32)
+                pitch = torch.tensor(pitch, device=self.device).unsqueeze(0).long()
+                pitchf = torch.tensor(pitchf, device=self.device).unsqueeze(0).float()
+            t2 = ttime()
+            times[1] += t2 - t1
+            for (a0, a1, f0, f1), (seg_feats, seg_feats0) in zip(bounds, feats):
+                audio1 = self.synthesize(
                     net_g,
                     sid,
-                    audio_pad[t:],
-                    pitch[:, t // self.window :] if t is not None else pitch,
-                    pitchf[:, t // self.window :] if t is not None else pitchf,
-                    times,
-                    index,
-                    big_npy,
-                    index_rate,
-                    version,
+                    audio_pad[a0:a1],
+                    seg_feats,
+                    seg_feats0,
+                    pitch[:, f0:f1] if if_f0 == 1 else None,
+                    pitchf[:, f0:f1] if if_f0 == 1 else None,
                     protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
-            )
-        else:
-            audio_opt.append(
-                self.vc(
+                    times,
+                )
+                end = len(audio) if a1 is None else a1 - self.t_pad2
+                yield audio1[self.t_pad_tgt : -self.t_pad_tgt], (a0, end)
+            del pitch, pitchf, sid
+        finally:
+            feats.close()
+
+    def pipeline(
+        self,
+        model,
+        net_g,
+        sid,
+        audio,
+        input_audio_path,
+        times,
+        f0_up_key,
+        f0_method,
+        file_index,
+        # file_big_npy,
+        index_rate,
+        if_f0,
+        filter_radius,
+        tgt_sr,
+        resample_sr,
+        rms_mix_rate,
+        version,
+        protect,
+        f0_file=None,
+        depth=0,
+    ):
+        audio = signal.filtfilt(bh, ah, audio)
+        audio_opt = np.concatenate(
+            [
+                audio1
+                for audio1, _ in self.convert_segments(
                     model,
                     net_g,
                     sid,
-                    audio_pad[t:],
-                    None,
-                    None,
+                    audio,
+                    input_audio_path,
                     times,
-                    index,
-                    big_npy,
+                    f0_up_key,
+                    f0_method,
+                    file_index,
                     index_rate,
+                    if_f0,
+                    filter_radius,
                     version,
                     protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
-            )
-        audio_opt = np.concatenate(audio_opt)
+                    f0_file=f0_file,
+                    depth=depth,
+                )
+            ]
+        )
         if rms_mix_rate != 1:
             audio_opt = change_rms(audio, 16000, audio_opt, tgt_sr, rms_mix_rate)
         if resample_sr >= 16000 and tgt_sr != resample_sr:
@@ -443,7 +568,120 @@ class VC(object):
         if audio_max > 1:
             max_int16 /= audio_max
         audio_opt = (audio_opt * max_int16).astype(np.int16)
-        del pitch, pitchf, sid
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
         return audio_opt
+
+    def pipeline_stream(
+        self,
+        model,
+        net_g,
+        sid,
+        audio,
+        times,
+        f0_up_key,
+        f0_method,
+        file_index,
+        index_rate,
+        if_f0,
+        filter_radius,
+        tgt_sr,
+        rms_mix_rate,
+        version,
+        protect,
+        depth=0,
+    ):
+        """`pipeline` yielding int16 audio as each segment is synthesized
+
+        The whole output is not known up front, so the RMS mix is applied per
+        segment and peaks are clipped instead of normalizing the gain.
+        """
+        audio = signal.filtfilt(bh, ah, audio)
+        for audio1, (s, e) in self.convert_segments(
+            model,
+            net_g,
+            sid,
+            audio,
+            None,
+            times,
+            f0_up_key,
+            f0_method,
+            file_index,
+            index_rate,
+            if_f0,
+            filter_radius,
+            version,
+            protect,
+            depth=depth,
+        ):
+            if rms_mix_rate != 1:
+                audio1 = change_rms(audio[s:e], 16000, audio1, tgt_sr, rms_mix_rate)
+            yield (np.clip(audio1, -1, 32767 / 32768) * 32768).astype(np.int16)
+
+
+class Prefetched(object):
+    """Iterator over a `prefetch` worker's results; `close()` stops the worker
+
+    Closing works whether or not iteration has started, unlike closing a
+    generator that never ran.
+    """
+
+    def __init__(self, results, stop):
+        self._results = results
+        self._stop = stop
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._results)
+
+    def close(self):
+        self._stop.set()
+        self._results.close()
+
+
+def prefetch(fn, items, depth):
+    """Yield `fn(item)` for each item, computed up to `depth` items ahead
+
+    With `depth` > 0 a worker thread starts on the first items right away and
+    blocks once `depth` results are waiting. Errors are raised from the
+    iterator. Closing the iterator stops the worker.
+    """
+    if depth <= 0:
+        return (fn(item) for item in items)
+
+    results = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(result):
+        while not stop.is_set():
+            try:
+                results.put(result, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def work():
+        for item in items:
+            if stop.is_set():
+                return
+            try:
+                result = (fn(item), None)
+            except Exception as e:
+                put((None, e))
+                return
+            if not put(result):
+                return
+
+    threading.Thread(target=work, daemon=True).start()
+
+    def drain():
+        for _ in items:
+            result, error = results.get()
+            if error is not None:
+                raise error
+            yield result
+
+    return Prefetched(drain(), stop)
@@ -0,0 +1,137 @@
+"""
+Cache of Coqui TTS waveforms, before RVC, and of converted sentence clips.
+
+Repeated prompts (greetings, IVR menus) skip TTS and only run the RVC stage.
+Entries are keyed by a hash of the normalized text, emotion, speed and TTS
+model name. The RAM tier is an LRU bounded by bytes. The optional disk tier
+(see `DiskStore`) keeps the waveforms as int16 or float16 and survives
+restarts; disk hits are promoted to RAM. int16 arrays (converted PCM, see
+`sentence_cache`) are stored as they are.
+"""
+
+import hashlib
+import io
+import json
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from .disk_store import DiskStore
+
+DTYPES = ("int16", "float16")
+
+
+def normalize_text(text):
+    """NFKC with whitespace runs collapsed, so trivially different scripts match"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def encode(wav, sr, dtype):
+    pcm = wav.dtype == np.int16
+    if pcm:
+        audio = wav
+    elif dtype == "int16":
+        audio = np.round(np.clip(wav, -1, 1) * 32767).astype(np.int16)
+    else:
+        audio = wav.astype(np.float16)
+    buf = io.BytesIO()
+    np.savez(buf, audio=audio, sr=np.int64(sr), pcm=pcm)
+    return buf.getvalue()
+
+
+def decode(data):
+    with np.load(io.BytesIO(data)) as f:
+        audio, sr, pcm = f["audio"], int(f["sr"]), bool(f["pcm"])
+    if pcm:
+        return audio, sr
+    if audio.dtype == np.int16:
+        return audio.astype(np.float32) / 32767, sr
+    return audio.astype(np.float32), sr
+
+
+class TTSCache(object):
+    def __init__(self, max_bytes=0, directory=None, max_disk_bytes=0, dtype="int16"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown TTS cache dtype: {dtype}")
+        self.max_bytes = max_bytes  # 0 disables the RAM tier
+        self.dtype = dtype
+        self.disk = DiskStore(directory, max_disk_bytes, ".npz") if directory else None
+        self._wavs = OrderedDict()  # key -> (wav, sr)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_bytes=0, directory=None, max_disk_bytes=0, dtype="int16"):
+        self.__init__(max_bytes, directory, max_disk_bytes, dtype)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or self.disk is not None
+
+    @staticmethod
+    def key(text, emotion, speed, model):
+        script = json.dumps(
+            [model, normalize_text(text), emotion or "", float(speed or 1.0)]
+        )
+        return hashlib.sha256(script.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """`(wav, sr)` cached under `key`, or None. `wav` is read-only."""
+        with self._lock:
+            entry = self._wavs.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._wavs.move_to_end(key)
+                return entry
+        data = self.disk.get(key) if self.disk is not None else None
+        if data is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        wav, sr = decode(data)
+        with self._lock:
+            self.hits += 1
+        return self._remember(key, wav, sr)
+
+    def put(self, key, wav, sr):
+        """Cache `wav`, which becomes read-only, and return `(wav, sr)`"""
+        if self.disk is not None:
+            self.disk.put(key, encode(wav, sr, self.dtype))
+        return self._remember(key, wav, sr)
+
+    def _remember(self, key, wav, sr):
+        wav.flags.writeable = False  # shared between requests
+        if not self.max_bytes or wav.nbytes > self.max_bytes:
+            return wav, sr
+        with self._lock:
+            if key in self._wavs:
+                self._bytes -= self._wavs[key][0].nbytes
+            self._wavs[key] = (wav, sr)
+            self._bytes += wav.nbytes
+            while self._bytes > self.max_bytes:
+                _, (old, _) = self._wavs.popitem(last=False)
+                self._bytes -= old.nbytes
+                self.evictions += 1
+        return wav, sr
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "entries": len(self._wavs),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+        stats["disk"] = self.disk.stats() if self.disk is not None else None
+        return stats
+
+
+tts_cache = TTSCache()
+# Converted int16 clips of single sentences, keyed per speaker
+sentence_cache = TTSCache()
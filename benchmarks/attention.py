@@ -0,0 +1,52 @@
+"""
+Banded windowed self-attention against the reference path: time, peak memory
+and output difference. Each path runs in a fresh process so `ru_maxrss` is its
+own peak.
+
+    python -m benchmarks.attention
+"""
+
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+
+from app.rvc.infer_pack.attentions import MultiHeadAttention
+
+
+def run(t, channels, n_heads, memory_efficient):
+    torch.manual_seed(0)
+    attn = MultiHeadAttention(channels, channels, n_heads, window_size=10).eval()
+    x = torch.randn(1, channels, t)
+    x_mask = torch.ones(1, 1, t)
+    x_mask[:, :, t - t // 10 :] = 0  # padded tail
+    attn_mask = x_mask.unsqueeze(2) * x_mask.unsqueeze(-1)
+    with torch.no_grad():
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        attn.memory_efficient = memory_efficient
+        t0 = time.time()
+        out = attn(x, x, attn_mask)
+        ms = (time.time() - t0) * 1000
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        diff = ""
+        if memory_efficient:
+            attn.memory_efficient = False
+            diff = f", max |diff| {(out - attn(x, x, attn_mask)).abs().max():.1e}"
+    name = "banded" if memory_efficient else "reference"
+    print(f"t={t:5d} {name:9s} {ms:7.1f} ms, peak RSS +{(peak - base) / 1024:.0f} MiB{diff}")
+
+
+def main(frames=(500, 2000, 4000), channels=192, n_heads=2):
+    for t in frames:
+        for memory_efficient in (False, True):
+            subprocess.run(
+                [sys.executable, "-c", f"from benchmarks.attention import run; "
+                 f"run({t}, {channels}, {n_heads}, {memory_efficient})"],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
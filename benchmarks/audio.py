@@ -0,0 +1,28 @@
+"""
+In-process WAV decoding (`app.rvc.audio.decode_wav`) against the ffmpeg
+subprocess it replaces.
+
+    python -m benchmarks.audio <file.wav> [sr]
+"""
+
+import sys
+import timeit
+
+import numpy as np
+
+from app.rvc.audio import decode_wav
+from app.rvc.misc import load_audio_ffmpeg
+
+
+def main(file, sr=16000, number=20):
+    ffmpeg_s = timeit.timeit(lambda: load_audio_ffmpeg(file, sr), number=number)
+    inproc_s = timeit.timeit(lambda: decode_wav(file, sr), number=number)
+    a, b = load_audio_ffmpeg(file, sr), decode_wav(file, sr)
+    n = min(len(a), len(b))
+    print(f"ffmpeg:     {ffmpeg_s / number * 1000:.2f} ms/call")
+    print(f"in-process: {inproc_s / number * 1000:.2f} ms/call")
+    print(f"max abs diff: {np.abs(a[:n] - b[:n]).max():.4f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *map(int, sys.argv[2:3]))
@@ -0,0 +1,54 @@
+"""
+Time and peak numpy memory of `blend` / `blend_torch` against the original
+`np.sum(big_npy[ix] * weight[..., None], axis=1)` expression.
+
+    python -m benchmarks.index [models/<speaker>/added_*.index]
+"""
+
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import torch
+
+from app.rvc.index import blend, blend_torch, index_cache
+
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.time()
+    out = fn()
+    elapsed = time.time() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def main(file_index=None, frames=3000, k=8):
+    if file_index:
+        big_npy = index_cache.get(file_index)[1]
+    else:
+        big_npy = np.random.default_rng(0).standard_normal((50000, 768), np.float32)
+    rng = np.random.default_rng(1)
+    ix = rng.integers(0, len(big_npy), (frames, k))
+    weight = np.square(1 / rng.uniform(0.1, 10, (frames, k)).astype(np.float32))
+    weight /= weight.sum(axis=1, keepdims=True)
+    blend(big_npy, ix, weight)  # allocate the buffers outside the measurement
+
+    ref, t_ref, m_ref = measure(
+        lambda: np.sum(big_npy[ix] * np.expand_dims(weight, axis=2), axis=1)
+    )
+    out, t_out, m_out = measure(lambda: blend(big_npy, ix, weight))
+    big = torch.from_numpy(big_npy)
+    out_t, t_torch, _ = measure(lambda: blend_torch(big, ix, weight))
+    print(
+        f"original {t_ref * 1000:.1f}ms {m_ref / 2**20:.1f} MiB, "
+        f"blend {t_out * 1000:.1f}ms {m_out / 2**20:.1f} MiB, "
+        f"torch {t_torch * 1000:.1f}ms, max |diff| "
+        f"{np.abs(out - ref).max():.2e} / {np.abs(out_t.numpy() - ref).max():.2e}"
+    )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
@@ -0,0 +1,104 @@
+"""
+Frame-rate `SineGen` against the original audio-rate implementation.
+
+With the same seed both draw the same random numbers, so the outputs differ
+only by the float32 rounding of the phase, shown against a float64 evaluation
+of the same phase.
+
+    python -m benchmarks.sine_gen
+"""
+
+from time import time as ttime
+
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+from app.rvc.infer_pack.models import SineGen
+
+
+def sine_gen_reference(gen, f0, upp):
+    """The original audio-rate `SineGen.forward`"""
+    with torch.no_grad():
+        f0 = f0[:, None].transpose(1, 2)
+        f0_buf = torch.zeros(f0.shape[0], f0.shape[1], gen.dim, device=f0.device)
+        # fundamental component
+        f0_buf[:, :, 0] = f0[:, :, 0]
+        for idx in np.arange(gen.harmonic_num):
+            f0_buf[:, :, idx + 1] = f0_buf[:, :, 0] * (
+                idx + 2
+            )  # idx + 2: the (idx+1)-th overtone, (idx+2)-th harmonic
+        rad_values = (f0_buf / gen.sampling_rate) % 1
+        rand_ini = torch.rand(f0_buf.shape[0], f0_buf.shape[2], device=f0_buf.device)
+        rand_ini[:, 0] = 0
+        rad_values[:, 0, :] = rad_values[:, 0, :] + rand_ini
+        tmp_over_one = torch.cumsum(rad_values, 1)
+        tmp_over_one *= upp
+        tmp_over_one = F.interpolate(
+            tmp_over_one.transpose(2, 1),
+            scale_factor=upp,
+            mode="linear",
+            align_corners=True,
+        ).transpose(2, 1)
+        rad_values = F.interpolate(
+            rad_values.transpose(2, 1), scale_factor=upp, mode="nearest"
+        ).transpose(2, 1)
+        tmp_over_one %= 1
+        tmp_over_one_idx = (tmp_over_one[:, 1:, :] - tmp_over_one[:, :-1, :]) < 0
+        cumsum_shift = torch.zeros_like(rad_values)
+        cumsum_shift[:, 1:, :] = tmp_over_one_idx * -1.0
+        sine_waves = torch.sin(
+            torch.cumsum(rad_values + cumsum_shift, dim=1) * 2 * np.pi
+        )
+        sine_waves = sine_waves * gen.sine_amp
+        uv = gen._f02uv(f0)
+        uv = F.interpolate(uv.transpose(2, 1), scale_factor=upp, mode="nearest").transpose(
+            2, 1
+        )
+        noise_amp = uv * gen.noise_std + (1 - uv) * gen.sine_amp / 3
+        noise = noise_amp * torch.randn_like(sine_waves)
+        sine_waves = sine_waves * uv + noise
+    return sine_waves, uv, noise
+
+
+def f0_curve(frames, batch=1):
+    """A gliding f0 in Hz with unvoiced (0 Hz) stretches, [batch, frames]"""
+    t = torch.arange(frames, dtype=torch.float32)
+    f0 = 150 + 80 * torch.sin(t / 50)
+    f0[(t // 100) % 4 == 3] = 0
+    return torch.stack([f0 * (1 + 0.3 * i) for i in range(batch)])
+
+
+def main(seconds=(2, 10, 30), sr=40000, upp=400, harmonic_num=0):
+    gen = SineGen(sr, harmonic_num)
+    for s in seconds:
+        f0 = f0_curve(s * sr // upp)
+        times = []
+        outputs = []
+        for fn in (sine_gen_reference, SineGen.forward):
+            torch.manual_seed(0)
+            fn(gen, f0, upp)  # warm up
+            torch.manual_seed(0)
+            t0 = ttime()
+            with torch.no_grad():
+                outputs.append(fn(gen, f0, upp))
+            times.append(ttime() - t0)
+        # exact phase: cumsum of the per-sample increments in float64
+        rad = (f0[0, :, None].double() * torch.arange(1, gen.dim + 1) / sr) % 1
+        torch.manual_seed(0)
+        rad[0] += torch.rand(1, gen.dim)[0].double() * (torch.arange(gen.dim) > 0)
+        phase = torch.cumsum(rad.repeat_interleave(upp, 0), 0) % 1
+        uv = (f0[0] > gen.voiced_threshold).repeat_interleave(upp)[:, None]
+        exact = (torch.sin(phase * 2 * np.pi) * gen.sine_amp * uv).float()
+        errors = [
+            ((out[0] - out[2])[0] - exact).abs().max().item() for out in outputs
+        ]
+        print(
+            f"{s:3d}s: original {times[0] * 1000:7.1f} ms (max |err| {errors[0]:.1e}), "
+            f"vectorized {times[1] * 1000:7.1f} ms (max |err| {errors[1]:.1e}), "
+            f"max |diff| {(outputs[0][0] - outputs[1][0]).abs().max().item():.1e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
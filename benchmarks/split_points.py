@@ -0,0 +1,59 @@
+"""
+`split_points` against the original RVC loop on minutes-long inputs.
+
+    python -m benchmarks.split_points
+"""
+
+from time import time as ttime
+
+import numpy as np
+from scipy import signal
+
+from app.rvc.vc_infer_pipeline import ah, bh, split_points
+
+
+def split_points_loop(audio_pad, n, window, t_center, t_query):
+    """The original RVC cut point search that `split_points` vectorizes"""
+    audio_sum = np.zeros(n)
+    for i in range(window):
+        audio_sum += audio_pad[i : i - window]
+    opt_ts = []
+    for t in range(t_center, n, t_center):
+        opt_ts.append(
+            t
+            - t_query
+            + np.where(
+                np.abs(audio_sum[t - t_query : t + t_query])
+                == np.abs(audio_sum[t - t_query : t + t_query]).min()
+            )[0][0]
+        )
+    return opt_ts
+
+
+def split_args(seconds, sr=16000, x_center=1.0, x_query=0.2, seed=0):
+    """`split_points` arguments for `seconds` of high-passed noise"""
+    rng = np.random.default_rng(seed)
+    audio = signal.filtfilt(
+        bh, ah, rng.standard_normal(int(seconds * sr)) * 0.1
+    )
+    audio_pad = np.pad(audio, (80, 80), mode="reflect")
+    return audio_pad, audio.shape[0], 160, int(sr * x_center), int(sr * x_query)
+
+
+def main(minutes=(5, 10, 30), x_center=38, x_query=6):
+    for m in minutes:
+        args = split_args(m * 60, x_center=x_center, x_query=x_query)
+        t0 = ttime()
+        expected = split_points_loop(*args)
+        t1 = ttime()
+        opt_ts = split_points(*args)
+        t2 = ttime()
+        assert opt_ts == expected, (m, opt_ts, expected)
+        print(
+            f"{m} min: loop {t1 - t0:.3f}s, vectorized {t2 - t1:.3f}s "
+            f"({(t1 - t0) / (t2 - t1):.0f}x), {len(opt_ts)} identical split points"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+WN's fused in-place inference path against the reference path.
+
+    python -m benchmarks.wn
+"""
+
+import time
+
+import torch
+from torch import nn
+
+from app.rvc.infer_pack.modules import WN
+
+
+def main(frames=(200, 1000, 4000), hidden=192, n_layers=3, gin=256, repeat=5):
+    torch.manual_seed(0)
+    wn = WN(hidden, 5, 1, n_layers, gin_channels=gin).eval()
+    emb_g = nn.Embedding(4, gin)
+    wn.precompute_cond(emb_g)
+    sid = torch.LongTensor([2])
+    for t in frames:
+        x = torch.randn(1, hidden, t)
+        x_mask = torch.ones(1, 1, t)
+        g = emb_g(sid).unsqueeze(-1)
+        outputs = []
+        times = []
+        with torch.no_grad():
+            for fused in (False, True):
+                WN.fused = fused
+                wn(x, x_mask, g=g, sid=sid)  # warm up
+                t0 = time.time()
+                for _ in range(repeat):
+                    out = wn(x, x_mask, g=g, sid=sid)
+                times.append((time.time() - t0) / repeat * 1000)
+                outputs.append(out)
+        WN.fused = True
+        print(
+            f"t={t:5d}: reference {times[0]:6.2f} ms, fused {times[1]:6.2f} ms, "
+            f"max |diff| {(outputs[0] - outputs[1]).abs().max().item():.1e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
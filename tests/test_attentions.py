@@ -0,0 +1,34 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+attentions = pytest.importorskip("app.rvc.infer_pack.attentions")
+
+
+def run_both(t, channels=16, n_heads=2, heads_share=True):
+    """(banded, reference) outputs of one windowed self-attention layer"""
+    torch.manual_seed(0)
+    attn = attentions.MultiHeadAttention(
+        channels, channels, n_heads, window_size=10, heads_share=heads_share
+    ).eval()
+    x = torch.randn(2, channels, t)
+    x_mask = torch.ones(2, 1, t)
+    x_mask[1, :, t - t // 3 :] = 0  # padded tail
+    attn_mask = x_mask.unsqueeze(2) * x_mask.unsqueeze(-1)
+    with torch.no_grad():
+        banded = attn(x, x, attn_mask)
+        attn.memory_efficient = False
+        reference = attn(x, x, attn_mask)
+    return banded, reference
+
+
+@pytest.mark.parametrize("t", [4, 10, 11, 37])
+@pytest.mark.parametrize("heads_share", [True, False])
+def test_banded_attention_matches_reference(t, heads_share):
+    banded, reference = run_both(t, heads_share=heads_share)
+    torch.testing.assert_close(banded, reference, rtol=1e-4, atol=1e-5)
+
+
+def test_banded_attention_in_row_chunks(monkeypatch):
+    monkeypatch.setattr(attentions, "ATTENTION_CHUNK_ELEMENTS", 2 * 2 * 3 * 37)
+    banded, reference = run_both(37)
+    torch.testing.assert_close(banded, reference, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,40 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+from scipy import signal
+from scipy.io import wavfile
+
+from app.rvc.audio import decode_wav, resample
+
+
+def noise(n, seed=0):
+    return np.random.default_rng(seed).uniform(-0.5, 0.5, n).astype(np.float32)
+
+
+@pytest.mark.parametrize("orig_sr, target_sr", [(22050, 16000), (16000, 40000)])
+def test_resample_matches_resample_poly(orig_sr, target_sr):
+    audio = noise(orig_sr // 4)
+    g = np.gcd(orig_sr, target_sr)
+    expected = signal.resample_poly(audio, target_sr // g, orig_sr // g)
+    np.testing.assert_allclose(resample(audio, orig_sr, target_sr), expected, atol=1e-6)
+
+
+def test_decode_wav_downmixes_and_scales(tmp_path):
+    stereo = (noise(1600).reshape(-1, 2) * 32767).astype(np.int16)
+    path = tmp_path / "stereo.wav"
+    wavfile.write(path, 16000, stereo)
+    expected = stereo.astype(np.float32).mean(axis=1) / 32768
+    np.testing.assert_allclose(decode_wav(path, 16000), expected, atol=1e-6)
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs the ffmpeg CLI")
+def test_decode_wav_matches_ffmpeg(tmp_path):
+    path = tmp_path / "mono.wav"
+    wavfile.write(path, 16000, (noise(8000) * 32767).astype(np.int16))
+    cmd = ["ffmpeg", "-nostdin", "-i", str(path), "-f", "f32le"]
+    cmd += ["-acodec", "pcm_f32le", "-ac", "1", "-ar", "16000", "-"]
+    out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    expected = np.frombuffer(out, np.float32)
+    np.testing.assert_allclose(decode_wav(path, 16000), expected, atol=1e-6)
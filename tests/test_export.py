@@ -0,0 +1,43 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+models = pytest.importorskip("app.rvc.infer_pack.models")
+export = pytest.importorskip("app.rvc.export")
+
+# A small v2 synthesizer: 768-dim phones, 40 kHz, 4 speakers
+CONFIG = [
+    1025, 32, 32, 32, 64, 2, 2, 3, 0, "1", [3, 7], [[1, 3, 5], [1, 3, 5]],
+    [10, 10, 2, 2], 64, [16, 16, 4, 4], 4, 32, 40000,
+]
+FRAMES = (37, 64, 150)  # none of them the traced length (200)
+
+
+@pytest.fixture(scope="module")
+def net_g():
+    torch.manual_seed(0)
+    net_g = models.SynthesizerTrnMs768NSFsid(*CONFIG, is_half=False).eval()
+    del net_g.enc_q
+    return net_g
+
+
+def assert_matches_eager(net_g, synth):
+    for frames in FRAMES:
+        args = export.example_inputs(net_g, 1, frames, seed=frames)
+        with torch.no_grad():
+            expected = net_g.infer(*args)[0]
+        out = synth.infer(*args)[0]
+        assert out.shape == expected.shape
+        torch.testing.assert_close(out, expected, rtol=1e-3, atol=1e-4)
+
+
+def test_torchscript_matches_eager(net_g, tmp_path):
+    with export.no_noise():
+        path = export.export_torchscript(net_g, 1, str(tmp_path / "voice.ts"))
+        assert_matches_eager(net_g, export.TorchScriptSynth(path))
+
+
+def test_onnx_matches_eager(net_g, tmp_path):
+    pytest.importorskip("onnxruntime")
+    with export.no_noise():
+        path = export.export_onnx(net_g, 1, str(tmp_path / "voice.onnx"))
+        assert_matches_eager(net_g, export.OnnxSynth(path))
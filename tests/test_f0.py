@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pyworld")
+pytest.importorskip("parselmouth")
+f0 = pytest.importorskip("app.rvc.f0")
+
+
+@pytest.fixture(scope="module")
+def audio():
+    """25 s of a gliding harmonic tone with a 0.4 s pause every 2 s"""
+    rng = np.random.default_rng(0)
+    t = np.arange(25 * f0.SR) / f0.SR
+    pitch = 170 + 50 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / f0.SR
+    audio = sum(np.sin(k * phase) / k for k in range(1, 8)) * 0.3
+    audio *= (t % 2) < 1.6
+    return audio + rng.standard_normal(len(t)) * 1e-3
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = f0.F0Engine(2)
+    assert engine.enabled(np.zeros(25 * f0.SR))
+    yield engine
+    engine.shutdown()
+
+
+def test_chunked_harvest_matches_single_pass(audio, engine):
+    single = f0.harvest(audio)
+    chunked = engine.harvest(audio)
+    assert chunked.shape == single.shape
+    np.testing.assert_allclose(chunked, single, rtol=0, atol=0.01)
+
+
+def test_chunked_pm_close_to_single_pass(audio, engine):
+    single = f0.pm_grid(audio)
+    chunked = engine.pm(audio)
+    assert chunked.shape == single.shape
+    assert np.mean(single > 0) > 0.7
+    assert np.mean((single > 0) == (chunked > 0)) >= 0.98
+    voiced = (single > 0) & (chunked > 0)
+    cents = 1200 * np.abs(np.log2(chunked[voiced] / single[voiced]))
+    assert np.median(cents) < 15
+    assert np.percentile(cents, 95) < 30
+
+
+def test_crossfade_never_mixes_with_unvoiced():
+    prev = np.array([100.0, 100.0, 0.0, 100.0, 100.0])
+    nxt = np.array([200.0, 0.0, 200.0, 200.0, 200.0])
+    np.testing.assert_allclose(f0.crossfade(prev, nxt), [100, 100, 200, 175, 200])
@@ -0,0 +1,89 @@
+import threading
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+index = pytest.importorskip("app.rvc.index")
+
+
+def neighbours(rows=200, dim=16, frames=50, k=4, seed=0):
+    rng = np.random.default_rng(seed)
+    big_npy = rng.standard_normal((rows, dim), np.float32)
+    ix = rng.integers(0, rows, (frames, k))
+    ix[0, -1] = -1  # faiss' id for a missing neighbour
+    weight = rng.uniform(0.1, 1, (frames, k)).astype(np.float32)
+    weight /= weight.sum(axis=1, keepdims=True)
+    return big_npy, ix, weight
+
+
+def reference(big_npy, ix, weight):
+    """The original RVC expression"""
+    return np.sum(big_npy[ix] * np.expand_dims(weight, axis=2), axis=1)
+
+
+def test_blend_matches_reference():
+    args = neighbours()
+    np.testing.assert_allclose(index.blend(*args), reference(*args), atol=1e-5)
+
+
+def test_blend_reuses_buffers_across_sizes():
+    small, large = neighbours(frames=10, seed=1), neighbours(frames=80, seed=2)
+    index.blend(*large)
+    np.testing.assert_allclose(index.blend(*small), reference(*small), atol=1e-5)
+
+
+def test_blend_torch_matches_reference():
+    big_npy, ix, weight = neighbours()
+    out = index.blend_torch(torch.from_numpy(big_npy), ix, weight)
+    np.testing.assert_allclose(out.numpy(), reference(big_npy, ix, weight), atol=1e-5)
+
+
+def test_loading_one_index_does_not_block_hits_on_another(tmp_path, monkeypatch):
+    cache = index.IndexCache()
+    fast, slow = tmp_path / "fast.index", tmp_path / "slow.index"
+    fast.write_bytes(b"")
+    slow.write_bytes(b"")
+    loading, release = threading.Event(), threading.Event()
+
+    class Index:
+        ntotal, d = 0, 0
+
+    def read_index(path):
+        if path == str(slow):
+            loading.set()
+            release.wait(5)
+        return Index(), np.zeros((0, 0), np.float32)
+
+    monkeypatch.setattr(index, "read_index", read_index)
+    monkeypatch.setattr(index, "apply_search_params", lambda *args: None)
+    cache.get(str(fast))
+    loader = threading.Thread(target=cache.get, args=(str(slow),))
+    loader.start()
+    assert loading.wait(5)
+    try:
+        hit = threading.Thread(target=cache.get, args=(str(fast),))
+        hit.start()
+        hit.join(2)
+        assert not hit.is_alive()  # served while slow.index is still loading
+        assert cache.hits == 1
+    finally:
+        release.set()
+        loader.join()
+    assert cache.misses == 2
+
+
+def test_sidecar_written_after_loading_is_mapped(tmp_path):
+    faiss = pytest.importorskip("faiss")
+    big_npy = np.random.default_rng(0).standard_normal((100, 8), np.float32)
+    flat = faiss.IndexFlatL2(8)
+    flat.add(big_npy)
+    path = str(tmp_path / "voice.index")
+    faiss.write_index(flat, path)
+    cache = index.IndexCache()
+    assert not isinstance(cache.get(path)[1], np.memmap)
+    index.write_sidecar(path)
+    mapped = cache.get(path)[1]
+    assert isinstance(mapped, np.memmap)
+    np.testing.assert_array_equal(mapped, big_npy)
+    assert cache.misses == 2
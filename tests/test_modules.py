@@ -0,0 +1,54 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+modules = pytest.importorskip("app.rvc.infer_pack.modules")
+
+
+@pytest.fixture
+def wn():
+    torch.manual_seed(0)
+    wn = modules.WN(16, 5, 1, 3, gin_channels=8).eval()
+    emb_g = torch.nn.Embedding(4, 8)
+    wn.precompute_cond(emb_g)
+    return wn, emb_g
+
+
+def run(wn, fused, *args, **kwargs):
+    old = modules.WN.fused
+    modules.WN.fused = fused
+    try:
+        with torch.no_grad():
+            return wn(*args, **kwargs)
+    finally:
+        modules.WN.fused = old
+
+
+def inputs(t=40):
+    x = torch.randn(2, 16, t)
+    x_mask = torch.ones(2, 1, t)
+    x_mask[1, :, t // 2 :] = 0
+    return x, x_mask
+
+
+def test_fused_matches_reference(wn):
+    wn, emb_g = wn
+    x, x_mask = inputs()
+    sid = torch.LongTensor([1, 3])
+    g = emb_g(sid).unsqueeze(-1)
+    expected = run(wn, False, x, x_mask, g=g, sid=sid)
+    x0 = x.clone()
+    torch.testing.assert_close(run(wn, True, x, x_mask, g=g, sid=sid), expected)
+    torch.testing.assert_close(run(wn, True, x, x_mask, g=g), expected)
+    assert torch.equal(x, x0)  # the in-place path works on its own copy
+
+
+def test_fused_without_speaker(wn):
+    wn, _ = wn
+    x, x_mask = inputs()
+    torch.testing.assert_close(run(wn, True, x, x_mask), run(wn, False, x, x_mask))
+
+
+def test_cond_table_follows_dtype(wn):
+    wn, _ = wn
+    assert "cond_table" not in wn.state_dict()
+    assert wn.double().cond_table.dtype == torch.float64
@@ -0,0 +1,42 @@
+import threading
+import time
+
+import pytest
+
+pipeline = pytest.importorskip("app.rvc.vc_infer_pipeline")
+reference = pytest.importorskip("benchmarks.split_points")
+
+
+@pytest.mark.parametrize("seconds", [0.5, 3, 10.3])
+def test_split_points_matches_loop(seconds):
+    args = reference.split_args(seconds)
+    assert pipeline.split_points(*args) == reference.split_points_loop(*args)
+
+
+def test_prefetch_yields_in_order():
+    assert list(pipeline.prefetch(lambda i: i * i, range(6), depth=2)) == [
+        0, 1, 4, 9, 16, 25,
+    ]
+
+
+def test_prefetch_raises_worker_errors():
+    def fn(i):
+        if i == 2:
+            raise ValueError(i)
+        return i
+
+    results = pipeline.prefetch(fn, range(4), depth=1)
+    assert next(results) == 0
+    assert next(results) == 1
+    with pytest.raises(ValueError):
+        next(results)
+
+
+def test_prefetch_close_before_iterating_stops_worker():
+    before = threading.active_count()
+    results = pipeline.prefetch(lambda i: i, range(1000), depth=1)
+    results.close()
+    deadline = time.time() + 2
+    while threading.active_count() > before and time.time() < deadline:
+        time.sleep(0.05)
+    assert threading.active_count() == before